@@ -2,10 +2,19 @@
 
 """
 Testing the webhook, or manually send a message as DripBot
+
+With --file, sends every message in a file, or stdin for '-', over one
+kept-alive connection. Each line is a message, or a JSON object with
+"text" and optionally "channel", "username" and "icon_url".
 """
 
 import argparse
-from matterhook import Webhook
+import contextlib
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # -------------------------
 # Argument setup
@@ -20,7 +29,33 @@ parser.add_argument(
     '--message',
     type=str,
     help='Message to  be sent to the channel',
-    required=True,
+    )
+parser.add_argument(
+    '-f',
+    '--file',
+    type=str,
+    help='Send each line of this file as a message; - for stdin',
+    )
+parser.add_argument(
+    '--format',
+    choices=['auto', 'text', 'jsonl'],
+    default='auto',
+    help='Line format for --file: plain text, JSON lines, or auto to take '
+         'lines starting with { as JSON',
+    )
+parser.add_argument(
+    '-n',
+    '--concurrency',
+    type=int,
+    default=1,
+    help='Messages from --file in flight at once; 1 keeps them in order',
+    )
+parser.add_argument(
+    '-r',
+    '--rate',
+    type=float,
+    default=0,
+    help='Most messages from --file sent per second; 0 for no limit',
     )
 parser.add_argument(
     '-c',
@@ -49,36 +84,138 @@ parser.add_argument(
     action="store_true",
     help='Test mode: send the message to the "TEST_CHANNEL_NAME"\nchannel as user "DripBot Test"',
     )
-args = parser.parse_args()
 
-if args.test is True:
-    args.channel = "TEST_CHANNEL_NAME"
-    args.username = "DripBot Test"
 
-# -------------------------
-# Webhook setup
-# -------------------------
+def read_messages(lines, line_format='auto'):
+    """
+    Messages from lines of text.
+    :return: generator of (line number, keyword arguments for Webhook.send),
+             or (line number, exception) for a line that can't be read
+    """
+    for number, line in enumerate(lines, 1):
+        line = line.rstrip('\r\n')
+        if not line.strip():
+            continue
+        if line_format == 'text' or (line_format == 'auto' and not line.lstrip().startswith('{')):
+            yield number, {'message': line}
+            continue
+        try:
+            record = json.loads(line)
+            message = {'message': record['text']}
+        except (ValueError, KeyError, TypeError) as err:
+            yield number, ValueError('not a JSON object with "text": {}'.format(err))
+            continue
+        for key in ('channel', 'username', 'icon_url'):
+            if record.get(key):
+                message[key] = record[key]
+        yield number, message
 
-# mandatory parameters are url and your webhook API key
-dripbot = Webhook('https://mattermost.example.com', 'API_KEY_HERE')
-dripbot.username = args.username
-dripbot.icon_url = args.iconurl
 
+def send_all(dripbot, messages, concurrency=1, rate=0, errors=sys.stderr):
+    """
+    Send messages through one Webhook, concurrency at a time, at most
+    rate per second.
+    :param messages: iterable from read_messages(); read as it is sent
+    :return: (sent, failed, seconds)
+    """
+    counts = {'sent': 0, 'failed': 0}
+    lock = threading.Lock()
+    # Bounds the messages in flight, so a long stream isn't read ahead
+    slots = threading.BoundedSemaphore(concurrency)
 
-# -------------------------
-# Test log prints
-# -------------------------
+    def finished(number, future):
+        error = future.exception()
+        with lock:
+            if error is None:
+                counts['sent'] += 1
+            else:
+                counts['failed'] += 1
+                print('Line {}: {}: {}'.format(number, type(error).__name__, error), file=errors)
+        slots.release()
 
-# print(f"Message: {args.message}")
-# print(f"Channel: {args.channel}")
-# print(f"User name: {args.username}")
-# print(f"Icon Url: {args.iconurl}")
-# print(f"Test: {args.test}")
+    started = time.perf_counter()
+    next_send = started
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for number, message in messages:
+            if isinstance(message, Exception):
+                with lock:
+                    counts['failed'] += 1
+                    print('Line {}: {}'.format(number, message), file=errors)
+                continue
+            if rate > 0:
+                now = time.perf_counter()
+                if next_send > now:
+                    time.sleep(next_send - now)
+                    now = next_send
+                next_send = now + 1.0 / rate
+            slots.acquire()
+            future = executor.submit(dripbot.send, **message)
+            future.add_done_callback(lambda future, number=number: finished(number, future))
+    return counts['sent'], counts['failed'], time.perf_counter() - started
+
+
+def main(argv=None):
+    """Parse the arguments, then send the message or messages
+    :return: exit status
+    """
+    args = parser.parse_args(argv)
+    if (args.message is None) == (args.file is None):
+        parser.error('give one of --message or --file')
+    if args.concurrency < 1:
+        parser.error('--concurrency must be at least 1')
+
+    if args.test is True:
+        args.channel = "TEST_CHANNEL_NAME"
+        args.username = "DripBot Test"
+
+    # -------------------------
+    # Webhook setup
+    # -------------------------
+
+    # Imported here, so that --help and argument errors don't wait on requests
+    from matterhook import Webhook
+
+    # mandatory parameters are url and your webhook API key
+    dripbot = Webhook('https://mattermost.example.com', 'API_KEY_HERE')
+    dripbot.username = args.username
+    dripbot.icon_url = args.iconurl
+    dripbot.channel = args.channel
+
+    # -------------------------
+    # Test log prints
+    # -------------------------
+
+    # print(f"Message: {args.message}")
+    # print(f"Channel: {args.channel}")
+    # print(f"User name: {args.username}")
+    # print(f"Icon Url: {args.iconurl}")
+    # print(f"Test: {args.test}")
+
+    # -------------------------
+    # Send the message
+    # -------------------------
+
+    if args.message is not None:
+        # send a message to the API_KEY's channel
+        # "scratch-area" for testing
+        with dripbot:
+            dripbot.send(args.message, channel=args.channel)
+        return 0
+
+    # Send every message in the file over the one session
+    dripbot.pool_size = args.concurrency
+    if args.file == '-':
+        # Left open: stdin isn't ours to close
+        source = contextlib.nullcontext(sys.stdin)
+    else:
+        source = open(args.file, encoding='utf-8')
+    with source as lines, dripbot:
+        sent, failed, seconds = send_all(dripbot, read_messages(lines, args.format),
+                                         args.concurrency, args.rate)
+    print('Sent {}, failed {}, in {:.2f} s ({:.1f} messages/s)'.format(
+        sent, failed, seconds, sent / seconds if seconds else 0.0))
+    return 1 if failed else 0
 
-# -------------------------
-# Send the message
-# -------------------------
 
-# send a message to the API_KEY's channel
-# "scratch-area" for testing
-dripbot.send(args.message, channel=args.channel)
+if __name__ == '__main__':
+    sys.exit(main())
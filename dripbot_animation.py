@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+
+"""Non-blocking animation engine for the DripBot NeoPixel ring.
+
+An Animator owns the strip and runs a render thread at a fixed frame
+rate. Each Ring is a run of pixels on the strip with its own queue of
+animations; playing an animation returns immediately.
+
+An animation is a callable taking the Ring and returning a generator
+that yields one frame (a list of packed 24-bit colors, one per pixel)
+per render tick. Ring.hold() repeats a frame for a number of
+milliseconds. Animations can be queued, preempted, or mixed with
+blend(). The last frame of an animation stays on the ring until the
+next one starts. An animation must not change a frame after yielding
+it, so frames can be held and shared without copying.
+
+Colors come from the tables in dripbot_palette, built once at startup.
+"""
+
+import collections
+import logging
+import threading
+import time
+
+from dripbot_framebuffer import FrameBuffer
+from dripbot_palette import pack, unpack
+
+logger = logging.getLogger('dripbot')
+
+OFF = 0
+
+
+class Ring(object):
+    """
+    A run of pixels on the strip, with its own animation queue.
+    """
+
+    def __init__(self, animator, start, count):
+        self.animator = animator
+        self.start = start
+        self.count = count
+        self.frame = [OFF] * count  # last frame rendered
+        self._current = None
+        self._current_done = None
+        self._queue = collections.deque()
+
+    @property
+    def fps(self):
+        return self.animator.fps
+
+    def frames_for(self, ms):
+        """Number of render ticks that last about ms milliseconds, at least 1"""
+        return max(1, int(round(ms * self.animator.fps / 1000.0)))
+
+    def hold(self, frame, ms):
+        """Generator yielding frame for ms milliseconds"""
+        for _ in range(self.frames_for(ms)):
+            yield frame
+
+    def play(self, animation, preempt=False, on_done=None):
+        """Queue an animation, or replace everything queued if preempt
+        :param animation: callable(ring) returning a frame generator
+        :param preempt: stop the current animation and drop the queue
+        :param on_done: callable(), run on the render thread when the
+                        animation finishes (not if it is preempted)
+        """
+        with self.animator._condition:
+            if preempt:
+                self._queue.clear()
+                if self._current is not None:
+                    self._current.close()
+                    self._current = None
+                    self._current_done = None
+            self._queue.append((animation, on_done))
+            self.animator._condition.notify()
+
+    def busy(self):
+        """True if an animation is playing or queued"""
+        with self.animator._condition:
+            return self._current is not None or bool(self._queue)
+
+    def _next_frame(self):
+        """Advance one tick; return the new frame, or None if idle.
+        Called on the render thread with the animator's lock held.
+        """
+        while True:
+            try:
+                if self._current is None:
+                    if not self._queue:
+                        return None
+                    animation, self._current_done = self._queue.popleft()
+                    self._current = iter(animation(self))
+                return next(self._current)
+            except StopIteration:
+                on_done = self._current_done
+                self._current = None
+                self._current_done = None
+                if on_done is not None:
+                    self.animator._finished.append(on_done)
+            except Exception:
+                logger.exception("Animation failed")
+                self._current = None
+                self._current_done = None
+
+
+class Animator(object):
+    """
+    Render thread driving one strip at a fixed frame rate.
+    """
+
+    def __init__(self, strip, fps=50):
+        """
+        :param strip: FrameBuffer; any other strip gets wrapped in one,
+                      so frames that change nothing are never pushed
+        :param fps: frames per second
+        """
+        self.strip = strip if isinstance(strip, FrameBuffer) else FrameBuffer(strip)
+        self.fps = fps
+        self.rings = []
+        self._condition = threading.Condition()
+        self._finished = []
+        self._thread = None
+        self._stopped = False
+
+    def ring(self, start=0, count=None):
+        """Add a Ring over count pixels from start; the whole strip by default"""
+        if count is None:
+            count = self.strip.numPixels() - start
+        ring = Ring(self, start, count)
+        with self._condition:
+            self.rings.append(ring)
+        return ring
+
+    def start(self):
+        """Start the render thread"""
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name='DripAnimator', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the render thread; the strip keeps its last frame"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def wait_idle(self, timeout=None):
+        """Block until no ring has an animation playing or queued"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while any(ring.busy() for ring in self.rings):
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(1.0 / self.fps)
+        return True
+
+    def _render(self):
+        """Advance every ring one tick into the framebuffer, then show it.
+        The framebuffer only pushes the strip if a pixel changed.
+        :return: True if any ring is still animating
+        """
+        animating = False
+        with self._condition:
+            for ring in self.rings:
+                frame = ring._next_frame()
+                if frame is None:
+                    continue
+                animating = True
+                self.strip.setPixelColors(ring.start, frame)
+                ring.frame = frame
+            finished, self._finished = self._finished, []
+        if animating:
+            self.strip.show()
+        for on_done in finished:
+            try:
+                on_done()
+            except Exception:
+                logger.exception("Animation callback failed")
+        return animating or bool(finished)
+
+    def _run(self):
+        """Render thread: one frame per tick while animating, else sleep"""
+        frame_time = 1.0 / self.fps
+        next_tick = time.monotonic()
+        while True:
+            with self._condition:
+                while not self._stopped and not any(
+                        ring._current is not None or ring._queue for ring in self.rings):
+                    self._condition.wait()
+                    next_tick = time.monotonic()
+                if self._stopped:
+                    return
+            self._render()
+            next_tick += frame_time
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Running late: don't try to catch up with a burst of frames
+                next_tick = time.monotonic()
+
+
+# ----------
+# Animations
+# ----------
+
+def ring_flash(color, flashes, wait_ms=50):
+    """Flash the whole ring on and off; engine port of ringFlash"""
+    def animation(ring):
+        on = [color] * ring.count
+        off = [OFF] * ring.count
+        for _ in range(flashes):
+            yield from ring.hold(on, wait_ms)
+            yield from ring.hold(off, wait_ms)
+    return animation
+
+
+def timer_setup(color_list, wait_ms=50):
+    """
+    Wipe colors onto the ring a pixel at a time, last pixel first;
+    engine port of ringTimerSetup.
+    :param color_list: table of packed colors from dripbot_palette, one per
+                       pixel; [red, green, blue] lists are packed once here
+    """
+    colors = [color if isinstance(color, int) else pack(*color) for color in color_list]
+
+    def animation(ring):
+        frame = list(ring.frame)
+        for index in range(ring.count - 1, -1, -1):
+            frame[index] = colors[index]
+            yield from ring.hold(list(frame), wait_ms)
+    return animation
+
+
+def color_wipe(color, wait_ms=50):
+    """Wipe a color across the ring a pixel at a time; engine port of colorWipe"""
+    def animation(ring):
+        frame = list(ring.frame)
+        for index in range(ring.count):
+            frame[index] = color
+            yield from ring.hold(list(frame), wait_ms)
+    return animation
+
+
+def set_pixel(index, color):
+    """Change one pixel, keeping the rest of the ring as it is"""
+    def animation(ring):
+        frame = list(ring.frame)
+        frame[index] = color
+        yield frame
+    return animation
+
+
+def show_frame(frame):
+    """Put a whole frame on the ring in one tick"""
+    def animation(ring):
+        yield list(frame)
+    return animation
+
+
+def blend(first, second, weight=0.5):
+    """Mix two animations pixel by pixel, weight being the share of second.
+    Runs until both have finished; one that ends early holds its last frame.
+    """
+    def animation(ring):
+        first_frames = iter(first(ring))
+        second_frames = iter(second(ring))
+        first_frame = second_frame = list(ring.frame)
+        while True:
+            first_frame, first_running = _advance(first_frames, first_frame)
+            second_frame, second_running = _advance(second_frames, second_frame)
+            if not (first_running or second_running):
+                return
+            yield [_mix(a, b, weight) for a, b in zip(first_frame, second_frame)]
+    return animation
+
+
+def crossfade(animation, ms=250):
+    """Fade from the ring's current frame into animation over ms milliseconds"""
+    def faded(ring):
+        start = list(ring.frame)
+        fade_frames = ring.frames_for(ms)
+        tick = 0
+        frame = start
+        for frame in animation(ring):
+            tick += 1
+            yield [_mix(a, b, min(1.0, tick / float(fade_frames)))
+                   for a, b in zip(start, frame)]
+        # Finish the fade onto the last frame of a short animation
+        while tick < fade_frames:
+            tick += 1
+            yield [_mix(a, b, tick / float(fade_frames)) for a, b in zip(start, frame)]
+    return faded
+
+
+def _advance(frames, last):
+    """Next frame from a generator, or the last one once it has finished"""
+    try:
+        return next(frames), True
+    except StopIteration:
+        return last, False
+
+
+def _mix(first, second, weight):
+    """Blend two packed colors; weight is the share of second"""
+    red1, green1, blue1 = unpack(first)
+    red2, green2, blue2 = unpack(second)
+    return pack(int(red1 + (red2 - red1) * weight),
+                int(green1 + (green2 - green1) * weight),
+                int(blue1 + (blue2 - blue1) * weight))
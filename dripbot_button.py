@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+"""Button state machine for DripBot.
+
+A Button watches both edges of an active-low push button and sorts
+presses into taps and holds:
+
+    idle -> pressed -> tapped -> cooldown -> idle
+                    -> held -> (release) -> cooldown -> idle
+
+The GPIO callback only timestamps each edge and passes it to the
+scheduler thread. All state lives on that one thread, so the state
+machine needs no lock and never blocks the GPIO thread. An edge takes
+effect once the level has stayed put for the debounce window, so
+contact bounce collapses into a single edge, timed from the last bounce.
+That is judged from the edge timestamps, so edges queued behind a busy
+scheduler still settle as they happened.
+Presses too short to be a tap, and presses during the cooldown after an
+accepted one, are rejected and counted.
+"""
+
+import logging
+import time
+
+logger = logging.getLogger('dripbot')
+
+IDLE = 'idle'
+PRESSED = 'pressed'
+HELD = 'held'
+COOLDOWN = 'cooldown'
+
+
+class Button(object):
+    """
+    Tap and hold detection for one button, run on a Scheduler.
+    """
+
+    def __init__(self, gpio, pin, scheduler, on_tap, on_hold,
+                 debounce=0.02, tap=0.1, hold=1.0, cooldown=1.0):
+        """
+        :param gpio: RPi.GPIO, or a simulated one from dripbot_hardware
+        :param pin: int, BCM pin the button pulls low
+        :param scheduler: Scheduler the state machine and callbacks run on
+        :param on_tap: callable(), for a press shorter than hold
+        :param on_hold: callable(), once the button has been held for hold
+        :param debounce: seconds the level must be steady to count
+        :param tap: seconds; shorter presses are rejected
+        :param hold: seconds down before a press is a hold
+        :param cooldown: seconds after a tap or hold before the next press
+        """
+        self.gpio = gpio
+        self.pin = pin
+        self.scheduler = scheduler
+        self.on_tap = on_tap
+        self.on_hold = on_hold
+        self.debounce = debounce
+        self.tap = tap
+        self.hold = hold
+        self.cooldown = cooldown
+        self.state = IDLE
+        self._down = False        # debounced level
+        self._level = False       # level of the latest edge
+        self._level_time = None   # monotonic time of the latest edge
+        self._pressed_at = None
+        self._settle_timer = None
+        self._settling = False
+        self._hold_timer = None
+        # Monotonic times of the last accepted press: its falling edge, and
+        # the release edge or hold deadline that decided it
+        self.last_press = None
+        self.last_decided = None
+        # Diagnostics
+        self.taps = 0
+        self.holds = 0
+        self.rejected = 0
+        self.bounces = 0
+
+    @property
+    def accepted(self):
+        return self.taps + self.holds
+
+    def start(self):
+        """Set up the pin and start watching it"""
+        self.gpio.setup(self.pin, self.gpio.IN, pull_up_down=self.gpio.PUD_UP)
+        self.gpio.add_event_detect(self.pin, self.gpio.BOTH, callback=self.edge)
+
+    def stop(self):
+        """Stop watching the pin"""
+        self.gpio.remove_event_detect(self.pin)
+
+    def stats(self):
+        """State and press counters, as a dictionary"""
+        return {'state': self.state, 'taps': self.taps, 'holds': self.holds,
+                'rejected': self.rejected, 'bounces': self.bounces}
+
+    def edge(self, channel):
+        """GPIO callback for either edge; hands it to the scheduler thread"""
+        self.scheduler.call_soon(self._edge, self.gpio.input(channel) == self.gpio.LOW,
+                                 time.monotonic())
+
+    # Everything below runs on the scheduler thread
+
+    def _edge(self, pressed, timestamp):
+        """Note an edge; it takes effect if nothing follows within debounce"""
+        if self._settling:
+            if timestamp - self._level_time >= self.debounce:
+                # The last edge held for the debounce window, and was only
+                # waiting on a busy scheduler: it takes effect at its own time
+                self._settled()
+            else:
+                self.bounces += 1
+        self._settling = True
+        self._level = pressed
+        self._level_time = timestamp
+        delay = timestamp + self.debounce - time.monotonic()
+        if self._settle_timer is None:
+            self._settle_timer = self.scheduler.schedule(delay, self._settled)
+        else:
+            self.scheduler.reschedule(self._settle_timer, delay)
+
+    def _settled(self):
+        """The level has been steady for the debounce window"""
+        self._settling = False
+        if self._level == self._down:
+            return  # Bounced back to where it was
+        self._down = self._level
+        if self._down:
+            self._press(self._level_time)
+        else:
+            self._release(self._level_time)
+
+    def _press(self, timestamp):
+        if self.state != IDLE:
+            # Cooling down from the last press
+            self.rejected += 1
+            logger.debug("Button press rejected while %s", self.state)
+            return
+        self.state = PRESSED
+        self._pressed_at = timestamp
+        self._hold_timer = self.scheduler.schedule(
+            timestamp + self.hold - time.monotonic(), self._held)
+
+    def _release(self, timestamp):
+        if self.state == HELD:
+            self._cool_down()
+            return
+        if self.state != PRESSED:
+            return
+        self.scheduler.cancel(self._hold_timer)
+        duration = timestamp - self._pressed_at
+        if duration >= self.hold:
+            self._held()
+        elif duration >= self.tap:
+            self.taps += 1
+            self.last_press = self._pressed_at
+            self.last_decided = timestamp
+            self._cool_down()
+            self.on_tap()
+        else:
+            self.rejected += 1
+            logger.debug("Button press rejected, %.3f s is too short", duration)
+            self.state = IDLE
+
+    def _held(self):
+        """The button has been down for hold seconds"""
+        if self.state != PRESSED:
+            return
+        if self._settling and self._level_time - self._pressed_at < self.hold:
+            # An edge in time is still settling: look again once it has
+            self.scheduler.reschedule(self._hold_timer, self.debounce)
+            return
+        self.state = HELD
+        self.holds += 1
+        self.last_press = self._pressed_at
+        self.last_decided = self._pressed_at + self.hold
+        if not self._down:
+            self._cool_down()
+        self.on_hold()
+
+    def _cool_down(self):
+        self.state = COOLDOWN
+        self.scheduler.schedule(self.cooldown, self._ready)
+
+    def _ready(self):
+        if self.state == COOLDOWN:
+            self.state = IDLE
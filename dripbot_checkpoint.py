@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+"""Countdown checkpoint for DripBot.
+
+A Checkpoint keeps the state of the ring's countdown in a small JSON
+file: its mode, when it started (wall-clock time, so it survives a
+reboot) and how long it lasts. The LED position is worked out from
+those, so nothing is written as each LED goes out; the file changes
+only when a countdown starts or ends.
+
+Writes are coalesced: save() and clear() only note the new state, and
+one write happens on the scheduler thread a few seconds later, however
+many changes came in between. Call them on the scheduler thread, like
+everything else that touches the countdown. Each write goes to a
+temporary file that is synced and then renamed over the checkpoint, so
+a power cut leaves either the old checkpoint or the new one, never a
+torn one.
+"""
+
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger('dripbot')
+
+_CLEAR = object()
+
+
+class Checkpoint(object):
+    """
+    Coalesced, atomic countdown state file.
+    """
+
+    def __init__(self, path, scheduler, delay=5.0):
+        """
+        :param path: checkpoint file
+        :param scheduler: Scheduler the writes run on
+        :param delay: seconds to gather changes before writing them
+        """
+        self.path = path
+        self.scheduler = scheduler
+        self.delay = delay
+        self.writes = 0
+        self._pending = None
+        self._written = None
+        self._timer = None  # pending write, if any
+
+    def load(self):
+        """
+        Read the checkpoint.
+        :return: dictionary with 'mode', 'start' (time.time() seconds) and
+                 'duration' (seconds), or None if there is no usable one
+        """
+        try:
+            with open(self.path) as checkpoint_file:
+                state = json.load(checkpoint_file)
+            state = {'mode': str(state['mode']), 'start': float(state['start']),
+                     'duration': float(state['duration'])}
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as err:
+            logger.warning("Ignoring unreadable checkpoint %s: %s", self.path, err)
+            return None
+        self._written = state
+        return state
+
+    def save(self, mode, start, duration):
+        """Note a countdown; it is written within delay seconds"""
+        self._queue({'mode': mode, 'start': start, 'duration': duration})
+
+    def clear(self):
+        """Note that no countdown is running; the file is removed within delay seconds"""
+        self._queue(_CLEAR)
+
+    def flush(self):
+        """Write any pending change now"""
+        self.scheduler.cancel(self._timer)
+        self._write()
+
+    def _queue(self, state):
+        self._pending = state
+        if self._timer is None:
+            self._timer = self.scheduler.schedule(self.delay, self._write)
+
+    def _write(self):
+        self._timer = None
+        state, self._pending = self._pending, None
+        if state is None:
+            return
+        if state is _CLEAR:
+            state = None
+        if state == self._written:
+            return
+        try:
+            if state is None:
+                os.remove(self.path)
+            else:
+                temp_path = self.path + '.tmp'
+                with open(temp_path, 'w') as checkpoint_file:
+                    json.dump(state, checkpoint_file)
+                    checkpoint_file.flush()
+                    os.fsync(checkpoint_file.fileno())
+                os.replace(temp_path, self.path)
+        except FileNotFoundError:
+            pass
+        except OSError as err:
+            logger.error("Could not write checkpoint %s: %s", self.path, err)
+            return
+        self._written = state
+        self.writes += 1
+
+
+def elapsed_seconds(state, now=None):
+    """
+    Seconds a checkpointed countdown has been running, or None if it has
+    finished or the clock says it has not started yet.
+    """
+    now = time.time() if now is None else now
+    seconds = now - state['start']
+    if seconds < 0 or seconds >= state['duration']:
+        return None
+    return seconds
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+"""Frame-diffed framebuffer for a NeoPixel strip.
+
+A FrameBuffer sits in front of an Adafruit_NeoPixel strip with the same
+numPixels/setPixelColor/getPixelColor/show methods. Pixel writes only
+go into an array of packed 24-bit colors; show() then hands the strip
+just the pixels that differ from the last pushed frame, and skips the
+push entirely when nothing changed. Each push sends the whole ring over
+DMA, so skipping the unchanged ones is the saving.
+"""
+
+from array import array
+import threading
+
+
+class FrameBuffer(object):
+    """
+    Array-backed RGB buffer with dirty tracking, over a NeoPixel strip.
+    """
+
+    def __init__(self, strip):
+        """
+        :param strip: Adafruit_NeoPixel, or anything with the same methods
+        """
+        self.strip = strip
+        count = strip.numPixels()
+        self._pixels = array('I', [0]) * count  # the frame being drawn
+        self._shown = array('I', [0]) * count   # the frame last pushed
+        self._dirty = False
+        self._lock = threading.Lock()
+        self.writes = 0         # setPixelColor calls
+        self.pushes = 0         # strip.show() calls made
+        self.pushes_saved = 0   # show() calls skipped, nothing had changed
+
+    def begin(self):
+        self.strip.begin()
+
+    def numPixels(self):
+        return len(self._pixels)
+
+    def getPixelColor(self, n):
+        return self._pixels[n]
+
+    def setPixelColor(self, n, color):
+        """Set pixel n in the buffer; nothing is sent until show()"""
+        self.writes += 1
+        if self._pixels[n] != color:
+            self._pixels[n] = color
+            self._dirty = True
+
+    def setPixelColors(self, start, colors):
+        """Set a run of pixels from start, one color each"""
+        for offset, color in enumerate(colors):
+            self.setPixelColor(start + offset, color)
+
+    def show(self):
+        """Push the changed pixels to the strip, if there are any
+        :return: True if the strip was pushed
+        """
+        with self._lock:
+            changed = False
+            if self._dirty:
+                pixels = self._pixels
+                shown = self._shown
+                for index in range(len(pixels)):
+                    if pixels[index] != shown[index]:
+                        self.strip.setPixelColor(index, pixels[index])
+                        shown[index] = pixels[index]
+                        changed = True
+                self._dirty = False
+            if not changed:
+                self.pushes_saved += 1
+                return False
+            self.strip.show()
+            self.pushes += 1
+            return True
+
+    def stats(self):
+        """Write and push counters, as a dictionary"""
+        return {'writes': self.writes, 'pushes': self.pushes, 'pushes_saved': self.pushes_saved}
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+
+"""Hardware backends for DripBot.
+
+load('pi') returns the real thing: RPi.GPIO for the button and an
+Adafruit_NeoPixel strip from the rpi_ws281x neopixel module. Those are
+only imported when the Pi backend is loaded.
+
+load('sim') returns a simulated backend that runs on any machine: a
+SimulatedGPIO with the parts of the RPi.GPIO interface DripBot uses,
+whose pins can be driven by scripted press, hold and bounce sequences,
+and a VirtualStrip that records every pushed frame with a timestamp.
+Together they let button-press scenarios be replayed off a Pi, to
+measure press-to-post latency and frame timing.
+
+dripbot_master picks the backend from the DRIPBOT_HARDWARE environment
+variable, 'pi' by default.
+"""
+
+import collections
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger('dripbot')
+
+BACKENDS = ('pi', 'sim')
+
+
+def Color(red, green, blue, white=0):
+    """Pack a color as neopixel.Color does"""
+    return (white << 24) | (red << 16) | (green << 8) | blue
+
+
+class PiHardware(object):
+    """Raspberry Pi: RPi.GPIO and an rpi_ws281x NeoPixel strip"""
+
+    name = 'pi'
+
+    def __init__(self):
+        import RPi.GPIO
+        import neopixel
+        self.GPIO = RPi.GPIO
+        self.neopixel = neopixel
+        self.Color = neopixel.Color
+
+    def strip(self, count, pin, freq_hz=800000, dma=10, invert=False, brightness=255,
+              channel=0, strip_type='WS2811_STRIP_GRB'):
+        """Create an Adafruit_NeoPixel strip; call begin() on it before use"""
+        return self.neopixel.Adafruit_NeoPixel(count, pin, freq_hz, dma, invert, brightness,
+                                               channel, getattr(self.neopixel.ws, strip_type))
+
+
+class SimulatedGPIO(object):
+    """
+    Stand-in for the RPi.GPIO module, with scriptable input pins.
+
+    Input levels start at HIGH for pull-ups and LOW otherwise. Edge
+    callbacks run on one callback thread, after the bouncetime filter,
+    as RPi.GPIO does.
+    """
+
+    BCM = 11
+    BOARD = 10
+    IN = 1
+    OUT = 0
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self):
+        self.mode = None
+        self._levels = {}
+        self._detect = {}
+        self._last_edge = {}
+        self._lock = threading.Lock()
+        self._callbacks = queue.Queue()
+        self._thread = None
+        # (timestamp, pin, level) for every level change driven on a pin
+        self.edges = []
+
+    # RPi.GPIO interface
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, channel, direction, pull_up_down=PUD_OFF, initial=LOW):
+        with self._lock:
+            if direction == self.IN:
+                self._levels[channel] = self.HIGH if pull_up_down == self.PUD_UP else self.LOW
+            else:
+                self._levels[channel] = initial
+
+    def input(self, channel):
+        with self._lock:
+            return self._levels[channel]
+
+    def output(self, channel, level):
+        with self._lock:
+            self._levels[channel] = level
+
+    def add_event_detect(self, channel, edge, callback=None, bouncetime=None):
+        with self._lock:
+            self._detect[channel] = (edge, [callback] if callback else [], bouncetime or 0)
+        self._start()
+
+    def add_event_callback(self, channel, callback):
+        with self._lock:
+            self._detect[channel][1].append(callback)
+
+    def remove_event_detect(self, channel):
+        with self._lock:
+            self._detect.pop(channel, None)
+
+    def cleanup(self, channel=None):
+        with self._lock:
+            if channel is None:
+                self._detect.clear()
+                self._levels.clear()
+            else:
+                self._detect.pop(channel, None)
+                self._levels.pop(channel, None)
+
+    # Scripting
+
+    def drive(self, channel, level):
+        """Set an input pin's level now, firing any matching edge callback"""
+        now = time.monotonic()
+        with self._lock:
+            previous = self._levels.get(channel)
+            self._levels[channel] = level
+            if previous == level:
+                return
+            self.edges.append((now, channel, level))
+            detect = self._detect.get(channel)
+            if detect is None:
+                return
+            edge, callbacks, bouncetime = detect
+            if edge == self.FALLING and level != self.LOW:
+                return
+            if edge == self.RISING and level != self.HIGH:
+                return
+            last = self._last_edge.get(channel)
+            if last is not None and (now - last) * 1000.0 < bouncetime:
+                return
+            self._last_edge[channel] = now
+            callbacks = list(callbacks)
+        for callback in callbacks:
+            self._callbacks.put((callback, channel))
+
+    def play(self, channel, steps, wait=True):
+        """Drive a pin through a script of (seconds to wait, level) steps
+        :return: the playback thread if not wait
+        """
+        def run():
+            for delay, level in steps:
+                if delay > 0:
+                    time.sleep(delay)
+                self.drive(channel, level)
+        if wait:
+            run()
+            return None
+        thread = threading.Thread(target=run, name='SimulatedGPIO-play', daemon=True)
+        thread.start()
+        return thread
+
+    def press(self, channel, hold=0.2, wait=True):
+        """Press an active-low button for hold seconds, then release it"""
+        return self.play(channel, [(0, self.LOW), (hold, self.HIGH)], wait)
+
+    def bounce(self, channel, hold=0.2, chatter=3, interval=0.002, wait=True):
+        """Press with contact bounce: chatter quick toggles, a hold, then release"""
+        steps = []
+        for _ in range(chatter):
+            steps += [(interval, self.LOW), (interval, self.HIGH)]
+        steps += [(interval, self.LOW), (hold, self.HIGH)]
+        return self.play(channel, steps, wait)
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run_callbacks,
+                                            name='SimulatedGPIO-callbacks', daemon=True)
+            self._thread.start()
+
+    def _run_callbacks(self):
+        while True:
+            callback, channel = self._callbacks.get()
+            try:
+                callback(channel)
+            except Exception:
+                logger.exception("GPIO callback failed")
+
+
+class VirtualStrip(object):
+    """
+    Stand-in for Adafruit_NeoPixel that records each shown frame.
+    """
+
+    def __init__(self, count, brightness=255, max_frames=100000):
+        self.count = count
+        self.brightness = brightness
+        self._pixels = [0] * count
+        # (timestamp, tuple of packed colors) for each show()
+        self.frames = collections.deque(maxlen=max_frames)
+
+    def begin(self):
+        pass
+
+    def numPixels(self):
+        return self.count
+
+    def setBrightness(self, brightness):
+        self.brightness = brightness
+
+    def getBrightness(self):
+        return self.brightness
+
+    def setPixelColor(self, n, color):
+        self._pixels[n] = color
+
+    def setPixelColorRGB(self, n, red, green, blue, white=0):
+        self._pixels[n] = Color(red, green, blue, white)
+
+    def getPixelColor(self, n):
+        return self._pixels[n]
+
+    def getPixels(self):
+        return list(self._pixels)
+
+    def show(self):
+        self.frames.append((time.monotonic(), tuple(self._pixels)))
+
+    def frame_intervals(self):
+        """Seconds between consecutive shown frames"""
+        times = [timestamp for timestamp, _ in self.frames]
+        return [later - earlier for earlier, later in zip(times, times[1:])]
+
+
+class SimulatedHardware(object):
+    """Simulated GPIO and NeoPixel strip, for running DripBot off a Pi"""
+
+    name = 'sim'
+
+    def __init__(self):
+        self.GPIO = SimulatedGPIO()
+        self.Color = Color
+        self.strips = []
+
+    def strip(self, count, pin, freq_hz=800000, dma=10, invert=False, brightness=255,
+              channel=0, strip_type='WS2811_STRIP_GRB'):
+        """Create a VirtualStrip; the other settings are accepted and ignored"""
+        strip = VirtualStrip(count, brightness)
+        self.strips.append(strip)
+        return strip
+
+
+def load(name='pi'):
+    """Load a hardware backend by name: 'pi' or 'sim'"""
+    if name == 'pi':
+        return PiHardware()
+    if name == 'sim':
+        return SimulatedHardware()
+    raise ValueError('Unknown hardware backend {!r}; expected one of {}'.format(
+        name, ', '.join(BACKENDS)))
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+"""Non-blocking logging for DripBot.
+
+Loggers only put records on an in-memory queue, through a QueueHandler
+on the root logger. A QueueListener thread does the slow part, writing
+them to a size-rotated log file on the SD card and to the console, so
+GPIO, scheduler and render threads never wait on a disk write.
+
+The 'dripbot' logger's level is set to the lowest level any handler
+keeps, so debug calls return straight away unless debug output is
+wanted. Wrap debug calls with expensive arguments in
+logger.isEnabledFor(logging.DEBUG).
+"""
+
+import logging
+import logging.handlers
+import queue
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LOG_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def start_logging(path='drip.log', file_level=logging.INFO, console_level=logging.ERROR,
+                  max_bytes=1024 * 1024, backup_count=3):
+    """
+    Route all logging through a queue to a rotating file and the console.
+    :param path: log file; rotated to path.1, path.2, ... at max_bytes
+    :param file_level: lowest level written to the file
+    :param console_level: lowest level written to the console
+    :param max_bytes: int, size at which the file is rotated
+    :param backup_count: int, number of rotated files kept
+    :return: the started QueueListener; stop() it at exit to flush the queue
+    """
+    formatter = logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT)
+    file_handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=max_bytes, backupCount=backup_count)
+    file_handler.setLevel(file_level)
+    file_handler.setFormatter(formatter)
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(console_level)
+    console_handler.setFormatter(formatter)
+
+    records = queue.Queue()
+    listener = logging.handlers.QueueListener(records, file_handler, console_handler,
+                                              respect_handler_level=True)
+    root = logging.getLogger()
+    root.addHandler(logging.handlers.QueueHandler(records))
+    # Libraries (freshdrip, matterhook) log warnings and up; DripBot logs
+    # whatever a handler will keep, and nothing more
+    root.setLevel(logging.WARNING)
+    logging.getLogger('dripbot').setLevel(min(file_level, console_level))
+    listener.start()
+    return listener
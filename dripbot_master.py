@@ -4,57 +4,72 @@
 
 Allows the user to hit a button and announce that a fresh pot of drip coffee has
 been brewed.
+
+Each coffee pot is a Station (see dripbot_station), with its own button,
+ring segment and countdown. With no stations file, there is one station,
+set up from the settings below. All the stations share one scheduler
+thread, one render thread driving one strip, and one webhook.
+
+main() brings up the button and the ring first and says DripBot is ready
+as soon as a press can be taken. The slow imports, requests and the word
+model, are loaded afterwards on the scheduler thread, ahead of any press
+that comes in meanwhile. Each phase of startup is timed and logged, up to
+the first accepted press.
 """
 
 import logging
+import os
+import signal
 import threading
 import time
-import RPi.GPIO as GPIO
-from dripbot_neopixel import *
-from matterhook import Webhook
-from freshdrip import DripWords
+
+# Taken before the other imports, so the startup report counts them
+STARTED = time.monotonic()
+
+import dripbot_hardware
+from dripbot_animation import Animator
+from dripbot_framebuffer import FrameBuffer
+from dripbot_logging import start_logging
+from dripbot_metrics import Metrics, StartupReport, uptime
+from dripbot_scheduler import Scheduler
+from dripbot_station import Station, load_stations, station_settings
 
 
 # ----------
-# Setup
+# Settings
 # ----------
 
-# Logging setup
-# create logger with 'spam_application'
-logger = logging.getLogger('dripbot')
-logger.setLevel(logging.DEBUG)
-# create file handler which logs even debug messages
-fh = logging.FileHandler('drip.log')
-fh.setLevel(logging.INFO)
-# create console handler with a higher log level
-ch = logging.StreamHandler()
-ch.setLevel(logging.ERROR)
-# create formatter and add it to the handlers
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-                              "%Y-%m-%d %H:%M:%S")
-fh.setFormatter(formatter)
-ch.setFormatter(formatter)
-# add the handlers to the logger
-logger.addHandler(fh)
-logger.addHandler(ch)
-logger.info("INFO logging enabled.")
-logger.debug("DEBUG logging enabled.")
-
-# Mattermost setup
-dripbot = Webhook('https://MATTERMOST.EXAMPLE.COM', 'API_KEY_HERE')
-dripbot.username = 'DripBot'
-dripbot.icon_url = "location/of/CoffeePot.png"
-dripbot.channel = "CHANNEL_NAME"
-
-# Drip words generator setup
-drip = DripWords()
-
-# Button hardware setup
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(24, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-button_processing = False
-
-# NeoPixel ring setup
+# Logging: records go through a queue to a listener thread, which
+# writes them to a rotating drip.log and, for errors, to the console
+LOG_FILE = 'drip.log'
+LOG_LEVEL = logging.INFO  # logging.DEBUG to log each step of the countdown
+
+# Hardware: DRIPBOT_HARDWARE=sim runs on simulated GPIO and a
+# virtual LED strip instead of the Pi's
+HARDWARE = os.environ.get('DRIPBOT_HARDWARE', 'pi')
+
+# Mattermost
+MATTERMOST_URL = 'https://MATTERMOST.EXAMPLE.COM'
+MATTERMOST_API_KEY = 'API_KEY_HERE'
+MATTERMOST_USERNAME = 'DripBot'
+MATTERMOST_ICON_URL = "location/of/CoffeePot.png"
+MATTERMOST_CHANNEL = "CHANNEL_NAME"
+# Set to a directory to keep announcements on disk until they are delivered,
+# retrying failed sends, instead of showing the red error ring
+SPOOL_DIR = None
+
+# Stations: a JSON file describing each coffee station. Without one,
+# there is a single station, using the button and LED settings below
+STATIONS_FILE = os.environ.get('DRIPBOT_STATIONS', 'stations.json')
+
+# Button
+BUTTON_PIN = 24
+BUTTON_DEBOUNCE = 0.02  # seconds the level must be steady to count as an edge
+BUTTON_TAP = 0.1        # seconds; shorter presses are rejected
+BUTTON_HOLD = 1.0       # seconds; a press this long is a drip-n-dash
+BUTTON_COOLDOWN = 1.0   # seconds after a press before the next, to prevent double-taps
+
+# NeoPixel ring
 # LED strip configuration:
 LED_COUNT      = 16      # Number of LED pixels.
 LED_PIN        = 18      # GPIO pin connected to the pixels (18 uses PWM!).
@@ -63,184 +78,264 @@ LED_DMA        = 10      # DMA channel to use for generating signal (try 10)
 LED_BRIGHTNESS = 10     # Set to 0 for darkest and 255 for brightest
 LED_INVERT     = False   # True to invert the signal (when using NPN transistor level shift)
 LED_CHANNEL    = 0       # set to '1' for GPIOs 13, 19, 41, 45 or 53
-LED_STRIP      = ws.WS2811_STRIP_GRB   # Strip type and colour ordering
-# Create NeoPixel object with appropriate configuration.
-strip = Adafruit_NeoPixel(LED_COUNT, LED_PIN, LED_FREQ_HZ, LED_DMA, LED_INVERT, LED_BRIGHTNESS, LED_CHANNEL, LED_STRIP)
-# Intialize the pixel library (must be called once before other functions).
-strip.begin()
-# Colors for the Fresh Drip timer ring: cyan to magenta
-FRESH_COLORS = [[0, 200, 200], [12, 188, 200], [25, 175, 200], [38, 162, 200],
-                [50, 150, 200], [62, 138, 200], [75, 125, 200], [88, 112, 200],
-                [100, 100, 200], [112, 88, 200], [125, 75, 200], [138, 62, 200],
-                [150, 50, 200], [162, 38, 200], [175, 25, 200], [200, 0, 200]]
-# Colors for the Drip-n-Dash delay function
-DRIPDASH_COLOR = Color(200, 160, 0)
-DRIPDASH_COLORS = [[200, 160, 0], [200, 160, 0], [200, 160, 0], [200, 160, 0],
-                   [200, 160, 0], [200, 160, 0], [200, 160, 0], [200, 160, 0],
-                   [200, 160, 0], [200, 160, 0], [200, 160, 0], [200, 160, 0],
-                   [200, 160, 0], [200, 160, 0], [200, 160, 0], [200, 160, 0]]
+LED_STRIP      = 'WS2811_STRIP_GRB'    # Strip type and colour ordering
+LED_FPS = 50
 DRIPDASH_DELAY = 5  # minutes
+FRESH_COUNTDOWN_LENGTH = 120  # minutes
 
+# Timing spans from button press to Mattermost post, in histograms served
+# as Prometheus text on localhost and summarized in the log
+METRICS_PORT = 9462           # None to not serve them
+METRICS_LOG_INTERVAL = 3600   # seconds between log summaries; None for none
+
+# The running countdown is checkpointed, so a restart picks it up again;
+# with several stations, each gets drip.checkpoint.<name>.json
+CHECKPOINT_FILE = 'drip.checkpoint.json'
+
+# Settings for a station that its stations file entry doesn't give
+STATION_DEFAULTS = {
+    'button_pin': BUTTON_PIN,
+    'button_debounce': BUTTON_DEBOUNCE,
+    'button_tap': BUTTON_TAP,
+    'button_hold': BUTTON_HOLD,
+    'button_cooldown': BUTTON_COOLDOWN,
+    'led_count': LED_COUNT,
+    'countdown_minutes': FRESH_COUNTDOWN_LENGTH,
+    'dash_delay_minutes': DRIPDASH_DELAY,
+    'checkpoint_file': CHECKPOINT_FILE,
+}
+
+# ----------
 # Globals
-DRIP_TIMER = None
-DRIP_TIME_BETWEEN_LEDS = 0
-DRIP_CURRENT_LED = 0
-FRESH_COUNTDOWN_LENGTH = 120  # minutes
+# ----------
+
+logger = logging.getLogger('dripbot')
+startup = StartupReport(STARTED)
+# Set up by main()
+GPIO = None
+scheduler = None
+metrics = None
+stations = []
+# Set up by startMessaging(), on the scheduler thread
+dripbot = None
+spool = None
+drip = None
+
+FIRST_PRESS = None  # monotonic time of the first accepted press
+METRICS_LOG_TIMER = None  # Scheduler handle for the next metrics summary
 
 # ----------
 # Functions
 # ----------
 
-def buttonHandler(channel):
-    """Handle the kinds of button presses"""
-    logger.debug("buttonHandler")
-    global button_processing
-    if button_processing == True:  # We're still processing the last button press
-        return                     # so ignore this new one
-    else:
-        button_processing = True   # Start processing
-
-    start_time = time.time()  # When the button was pressed
-
-    while GPIO.input(channel) == 0:  # Wait for button up
-        time.sleep(0.1)
-        # If the button is held for "long enough," act as if button up
-        if time.time() - start_time >= 1.1:
-            break
-
-    buttonTime = time.time() - start_time  # how long was the button down?
-
-    if buttonTime >= 1:
-        # GRUBER'D!
-        # User holds button until they see LEDs change
-        dripDash(strip)
-        time.sleep(1.0)  # to prevent double-taps
-        button_processing = False
-    elif buttonTime >= .1:
-        # Fresh drip.
-        # User momentary tap on button
-        fresh(strip)
-        time.sleep(1.0)  # to prevent double-taps
-        button_processing = False
+def noteFirstPress(station):
+    """Log how long after starting up the first press was accepted"""
+    global FIRST_PRESS
+    if FIRST_PRESS is not None:
+        return
+    FIRST_PRESS = station.button.last_press
+    since_start = startup.mark('first accepted press', FIRST_PRESS)
+    boot = uptime()
+    if boot is None:
+        logger.info("First accepted press, at %s, %.2f s after start.", station.name,
+                    since_start)
     else:
-        # It was probably a bounce, do nothing, but make sure the
-        # button_processing lock gets cleared
-        button_processing = False
-
-
-def dripDash(strip):
-    """Start the timer on a delay while it brews"""
-    logger.debug("dripDash()")
-    # If there is a timer thread currently running, cancel it.
-    global DRIP_TIMER
-    if (DRIP_TIMER is not None):
-        DRIP_TIMER.cancel()
+        logger.info("First accepted press, at %s, %.2f s after start, %.1f s after boot.",
+                    station.name, since_start, boot - (time.monotonic() - FIRST_PRESS))
 
-    # Animate lights (flashing) to indicate user has held button long enough
-    ringFlash(strip, DRIPDASH_COLOR, flashes=10, wait_ms=100)
 
-    # Animate lights (animate to full)
-    ringTimerSetup(strip, DRIPDASH_COLORS, wait_ms=50)
+def stationSettings():
+    """Settings for each station, from STATIONS_FILE if there is one"""
+    if os.path.exists(STATIONS_FILE):
+        return load_stations(STATIONS_FILE, STATION_DEFAULTS)
+    return station_settings([{}], STATION_DEFAULTS)
 
-    # Get a set of fresh drip nonsense words
-    drip_words = drip.fresh_drip()
 
-    # Count down the delay for brewing
-    try:
-        dripTimer(strip, timer_min=DRIPDASH_DELAY)
-    except Exception as err:
-        logger.error("Error sending: " + str(err))
-        colorWipe(strip, Color(255, 0, 0))
-
-    # Set a new timer to trigger fresh()
-    time.sleep(1.0)  # just to ensure the brew delay animation will finish
-                     # before dash_timer starts the fresh drip animations
-    delay_seconds = DRIPDASH_DELAY * 60
-    dash_timer = threading.Timer(delay_seconds, fresh, [strip])
-    dash_timer.start()
-
-
-def fresh(strip):
-    """There is a fresh pot of coffee"""
-    logger.debug("fresh()")
-    # If there is a timer thread currently running, cancel it.
-    global DRIP_TIMER
-    if (DRIP_TIMER is not None):
-        DRIP_TIMER.cancel()
-
-    # Animate lights (animate to full)
-    ringTimerSetup(strip, FRESH_COLORS, wait_ms=50)
-
-    # Get a set of fresh drip nonsense words
-    drip_words = drip.fresh_drip()
-
-    # Send message to Mattermost
-    try:
-        dripbot.send(drip_words)  # comment out while working at home
-        logger.info("Drip sent.")
-        # Start light timer for next hour
-        dripTimer(strip, timer_min=FRESH_COUNTDOWN_LENGTH)
-    except Exception as err:
-        logger.error("Error sending: " + str(err))
-        colorWipe(strip, Color(255, 0, 0))
-
-
-def dripTimer(strip, timer_min=60):
+def startMessaging(webhook_url=None):
     """
-    Sets up a threaded timer to "count down" turn off the ring lights
-    over a period of time.
+    Set up the webhook and the phrase pool. The imports here are the slow
+    part of startup, so this runs on the scheduler thread once DripBot is
+    ready. The edges of a press that comes in meanwhile are queued with
+    their timestamps, and the press is decided and handled after this.
     """
-    logger.debug("dripTimer()")
-    global DRIP_TIMER
-    global DRIP_TIME_BETWEEN_LEDS
-    global DRIP_CURRENT_LED
-    # Time in seconds between LEDs extinguished
-    DRIP_TIME_BETWEEN_LEDS = timer_min * 60.0 / LED_COUNT
-    # Reset the current LED to the first
-    DRIP_CURRENT_LED = 0
-    DRIP_TIMER = threading.Timer(DRIP_TIME_BETWEEN_LEDS, dripTimerDecrement, ['DRIP_TIMER', strip])
-    DRIP_TIMER.start()
-
-
-def dripTimerDecrement(channel, strip):
-    """Turn off one more light on the LED ring"""
-    logger.debug("dripTimerDecrement()")
-    global DRIP_TIMER
-    global DRIP_CURRENT_LED
-    # Turn off the current LED
-    logger.debug(DRIP_TIMER)
-    logger.debug(DRIP_CURRENT_LED)
-    logger.debug(DRIP_TIME_BETWEEN_LEDS)
-    logger.debug(strip)
-    strip.setPixelColor(DRIP_CURRENT_LED, Color(0, 0, 0))
-    strip.show()
-    DRIP_CURRENT_LED = DRIP_CURRENT_LED + 1
-    if DRIP_CURRENT_LED == LED_COUNT:
-        # We've turned them all off
+    global dripbot, spool, drip
+    with startup.phase('import matterhook'):
+        from matterhook import Webhook, Spool
+    with startup.phase('import freshdrip'):
+        from freshdrip import DripWords, PhrasePool
+
+    # Mattermost setup
+    with startup.phase('webhook'):
+        dripbot = Webhook(webhook_url or MATTERMOST_URL, MATTERMOST_API_KEY)
+        dripbot.username = MATTERMOST_USERNAME
+        dripbot.icon_url = MATTERMOST_ICON_URL
+        dripbot.channel = MATTERMOST_CHANNEL
+        if SPOOL_DIR is not None:
+            spool = Spool(dripbot, SPOOL_DIR)
+            spool.start()
+
+    # Drip words generator setup: keep a few phrases ready in the background,
+    # so a button press never waits on word generation
+    with startup.phase('phrase pool'):
+        drip = PhrasePool(DripWords(), depth=max(8, 2 * len(stations)), refill_at=4,
+                          history=64,
+                          timer=lambda seconds: metrics.record('phrase_generate', seconds))
+        drip.start()
+    for station in stations:
+        station.connect(dripbot, spool, drip)
+    metrics.register('phrase_pool_misses', lambda: drip.misses,
+                     'phrases generated on demand, not ready in the pool', kind='counter')
+    logger.info("Messaging ready.")
+    logStartup()
+
+
+def logStartup():
+    """Write the startup report to the log"""
+    logger.info("Startup: %12s | %12s | %s", 'phase', 'since start', 'name')
+    for line in startup.lines():
+        logger.info("Startup: %s", line)
+
+
+def notifyReady():
+    """Tell systemd DripBot is ready, if it was started as a notify service"""
+    address = os.environ.get('NOTIFY_SOCKET')
+    if not address:
         return
-    else:
-        DRIP_TIMER = threading.Timer(DRIP_TIME_BETWEEN_LEDS, dripTimerDecrement, ['DRIP_TIMER', strip])
-        DRIP_TIMER.start()
-
-
-# ----------
-# Okay, now do some things:
-# ----------
-
-# Detect the start of a button press
-GPIO.add_event_detect(24, GPIO.FALLING, callback=buttonHandler, bouncetime=300)
+    import socket
+    if address.startswith('@'):
+        address = '\0' + address[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as notify_socket:
+            notify_socket.connect(address)
+            notify_socket.sendall(b'READY=1')
+    except OSError as err:
+        logger.warning("Could not notify systemd: %s", err)
 
-# We're ready to go
-logger.info("DripBot ready.")
-ringFlash(strip, Color(0, 0, 255), flashes=10, wait_ms=100)
 
-# Idle loop
-while True:
-    time.sleep(0.1)
+def logMetrics():
+    """Write a summary of the timing spans to the log, then again later"""
+    for line in metrics.summary():
+        logger.info("Timing %s", line)
+    scheduler.reschedule(METRICS_LOG_TIMER, METRICS_LOG_INTERVAL)
 
 
 # ----------
-# Exiting
+# Okay, now do some things:
 # ----------
 
-GPIO.cleanup()
+def main(hardware=None, webhook_url=None, install_signals=True, shutdown=None):
+    """
+    Run DripBot until SIGTERM or Ctrl-C, or until shutdown is set.
+    The defaults run it for real; the arguments let dripbot_replay run it
+    on simulated hardware, off the main thread.
+    :param hardware: hardware backend from dripbot_hardware.load();
+                     HARDWARE's by default
+    :param webhook_url: URL to post to instead of MATTERMOST_URL
+    :param install_signals: False to leave SIGTERM and SIGINT alone, as
+                            must be done off the main thread
+    :param shutdown: threading.Event that stops DripBot when set
+    """
+    global GPIO, scheduler, metrics, stations, METRICS_LOG_TIMER
+
+    with startup.phase('logging'):
+        log_listener = start_logging(LOG_FILE, file_level=LOG_LEVEL, console_level=logging.ERROR)
+    logger.info("INFO logging enabled.")
+    logger.debug("DEBUG logging enabled.")
+
+    settings = stationSettings()
+    # One strip, long enough for every station's segment
+    led_count = max(station['led_start'] + station['led_count'] for station in settings)
+
+    # Hardware setup
+    with startup.phase('hardware'):
+        if hardware is None:
+            hardware = dripbot_hardware.load(HARDWARE)
+        GPIO = hardware.GPIO
+        GPIO.setmode(GPIO.BCM)
+        # Create NeoPixel object with appropriate configuration, behind a
+        # framebuffer that only pushes frames that changed
+        strip = FrameBuffer(hardware.strip(led_count, LED_PIN, LED_FREQ_HZ, LED_DMA, LED_INVERT,
+                                           LED_BRIGHTNESS, LED_CHANNEL, LED_STRIP))
+        # Intialize the pixel library (must be called once before other functions).
+        strip.begin()
+    logger.info("Using %s hardware.", hardware.name)
+
+    with startup.phase('threads'):
+        # The animator's render thread owns the strip; each station has a
+        # ring segment of it
+        animator = Animator(strip, fps=LED_FPS)
+        animator.start()
+        # One thread runs every button, countdown and drip-n-dash delay
+        scheduler = Scheduler()
+        scheduler.start()
+        metrics = Metrics()
+
+    # Each station watches both edges of its button; taps and holds are
+    # told apart on the scheduler thread, from the edge timestamps
+    with startup.phase('stations'):
+        stations = [Station(station, GPIO, scheduler, animator, metrics, noteFirstPress)
+                    for station in settings]
+        for station in stations:
+            station.start()
+    logger.info("Stations: %s", ', '.join(station.name for station in stations))
+
+    # Stop cleanly on SIGTERM or Ctrl-C
+    if shutdown is None:
+        shutdown = threading.Event()
+
+    def requestShutdown(signum, frame):
+        logger.info("Shutting down on signal %d.", signum)
+        shutdown.set()
+
+    if install_signals:
+        signal.signal(signal.SIGTERM, requestShutdown)
+        signal.signal(signal.SIGINT, requestShutdown)
+
+    # We're ready to go: presses are taken from here on. Their edges are
+    # timestamped as they come, so one made while the messaging is set up
+    # on the scheduler thread is decided from those times and handled after
+    scheduler.call_soon(startMessaging, webhook_url)
+    startup.mark('ready')
+    logger.info("DripBot ready.")
+    notifyReady()
+
+    # Decorations and metrics, now that presses are being taken. The
+    # metrics server imports http.server, so it starts on the scheduler
+    # thread too: imports racing on two threads can deadlock
+    for station in stations:
+        station.show_ready()
+    if METRICS_PORT is not None:
+        scheduler.call_soon(metrics.serve, METRICS_PORT)
+    if METRICS_LOG_INTERVAL is not None:
+        METRICS_LOG_TIMER = scheduler.schedule(METRICS_LOG_INTERVAL, logMetrics)
+
+    # Everything runs on the GPIO, scheduler and render threads; sleep
+    # until a signal asks us to stop
+    shutdown.wait()
+
+    # ----------
+    # Exiting
+    # ----------
+
+    for station in stations:
+        station.stop()
+    for line in metrics.summary():
+        logger.info("Timing %s", line)
+    metrics.close()
+    scheduler.stop()
+    for station in stations:
+        station.flush()
+    animator.stop()
+    if drip is not None:
+        drip.stop()
+    if spool is not None:
+        spool.close()
+    if dripbot is not None:
+        dripbot.close()
+    GPIO.cleanup()
+    logger.info("DripBot stopped.")
+    log_listener.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+"""In-process timing metrics for DripBot.
+
+Metrics keeps a Histogram per named span: how long a button press
+takes to handle, how long the ring animation runs, how long a phrase
+takes to generate and to take from the pool, how long a message takes
+from being queued to being sent, and the whole trip from press to post.
+Time a span with
+
+    with metrics.span('phrase_pop'):
+        ...
+
+or, when it starts and ends on different threads, metrics.observe()
+with a time.monotonic() start, or metrics.record() with a duration
+timed elsewhere. Counters owned by other objects, like
+the button's press counts, are registered as functions read at scrape
+time.
+
+render() gives the Prometheus text format, served on localhost by
+serve(); summary() gives one line per span, for a periodic log dump.
+
+StartupReport times the phases of startup, in the manner of
+python -X importtime, up to the first accepted button press.
+"""
+
+import bisect
+import contextlib
+import threading
+import time
+
+# Upper bounds, in seconds, of the histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PREFIX = 'dripbot_'
+
+
+class Histogram(object):
+    """Bucketed durations, with their count, sum and maximum"""
+
+    def __init__(self, name, help_text, buckets=BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        """Record one duration; the caller holds the registry lock"""
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """Estimate a quantile as the upper bound of the bucket it falls in"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class StartupReport(object):
+    """
+    Time from process start to each phase of startup.
+    """
+
+    def __init__(self, start=None):
+        """
+        :param start: time.monotonic() the process started at; now by default
+        """
+        self.start = time.monotonic() if start is None else start
+        self.phases = []  # (name, seconds taken, seconds since start)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time the body of a with statement as a named phase"""
+        began = time.monotonic()
+        try:
+            yield
+        finally:
+            now = time.monotonic()
+            self.phases.append((name, now - began, now - self.start))
+
+    def mark(self, name, at=None):
+        """Note that something happened, at a time.monotonic() value or now
+        :return: seconds since start
+        """
+        at = time.monotonic() if at is None else at
+        self.phases.append((name, 0.0, at - self.start))
+        return at - self.start
+
+    def lines(self):
+        """One line per phase: its own time and the time since start, in ms"""
+        return ['{:>9.1f} ms | {:>9.1f} ms | {}'.format(1000 * took, 1000 * since, name)
+                for name, took, since in self.phases]
+
+
+def uptime():
+    """Seconds since the system booted, or None where that is not known"""
+    try:
+        with open('/proc/uptime') as uptime_file:
+            return float(uptime_file.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Metrics(object):
+    """
+    Registry of span histograms and scrape-time values.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._values = []
+        self._server = None
+
+    def histogram(self, name, help_text=''):
+        """Get the named Histogram, creating it on first use"""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = Histogram(name, help_text or name.replace('_', ' '))
+                self._histograms[name] = histogram
+            return histogram
+
+    def observe(self, name, start):
+        """Record a span from start, a time.monotonic() value, to now"""
+        return self.record(name, time.monotonic() - start)
+
+    def record(self, name, seconds):
+        """Record a span of seconds into the named histogram"""
+        histogram = self.histogram(name)
+        with self._lock:
+            histogram.observe(seconds)
+        return seconds
+
+    @contextlib.contextmanager
+    def span(self, name):
+        """Time the body of a with statement into the named histogram"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, start)
+
+    def register(self, name, function, help_text='', kind='gauge', labels=None):
+        """
+        Report a value owned elsewhere, read when metrics are rendered.
+        :param function: callable() returning a number
+        :param kind: 'gauge' or 'counter'
+        :param labels: dictionary of labels, to report one name for several owners
+        """
+        with self._lock:
+            self._values.append((name, function, help_text or name.replace('_', ' '), kind,
+                                 labels or {}))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name in sorted(self._histograms):
+                histogram = self._histograms[name]
+                metric = PREFIX + name + '_seconds'
+                lines.append('# HELP {} {}'.format(metric, histogram.help))
+                lines.append('# TYPE {} histogram'.format(metric))
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append('{}_bucket{{le="{}"}} {}'.format(metric, bound, cumulative))
+                lines.append('{}_bucket{{le="+Inf"}} {}'.format(metric, histogram.count))
+                lines.append('{}_sum {}'.format(metric, histogram.sum))
+                lines.append('{}_count {}'.format(metric, histogram.count))
+            values = list(self._values)
+        described = set()
+        for name, function, help_text, kind, labels in sorted(values, key=lambda value: value[0]):
+            metric = PREFIX + name
+            if name not in described:
+                described.add(name)
+                lines.append('# HELP {} {}'.format(metric, help_text))
+                lines.append('# TYPE {} {}'.format(metric, kind))
+            if labels:
+                metric += '{' + ','.join('{}="{}"'.format(key, value)
+                                         for key, value in sorted(labels.items())) + '}'
+            lines.append('{} {}'.format(metric, function()))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """One line per span: count, mean, p50, p95 and max in milliseconds"""
+        lines = []
+        with self._lock:
+            for name in sorted(self._histograms):
+                histogram = self._histograms[name]
+                if not histogram.count:
+                    continue
+                lines.append('{}: n={} mean={:.1f}ms p50<={:.1f}ms p95<={:.1f}ms max={:.1f}ms'.format(
+                    name, histogram.count, 1000 * histogram.sum / histogram.count,
+                    1000 * histogram.quantile(0.5), 1000 * histogram.quantile(0.95),
+                    1000 * histogram.max))
+        return lines
+
+    def serve(self, port=9462, host='127.0.0.1'):
+        """Serve render() at http://host:port/metrics from a background thread"""
+        import http.server
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = http.server.HTTPServer((host, port), Handler)
+        thread = threading.Thread(target=self._server.serve_forever, name='DripMetrics',
+                                  daemon=True)
+        thread.start()
+        return self._server
+
+    def close(self):
+        """Stop serving, if serve() was called"""
+        server, self._server = self._server, None
+        if server is not None:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+"""Precomputed color tables for the DripBot ring.
+
+Colors are packed 24-bit ints, 0xRRGGBB, the same as neopixel.Color()
+makes. Tables are built once at startup, for any number of LEDs, as
+array('I') so animations index them instead of building colors per
+frame. Brightness scaling and gamma correction are applied while the
+table is built.
+"""
+
+from array import array
+
+# Gamma for WS2812 LEDs, so that evenly spaced values look evenly spaced
+LED_GAMMA = 2.8
+
+_gamma_tables = {}
+
+
+def pack(red, green, blue):
+    """Pack red, green and blue into a 24-bit color, as neopixel.Color does"""
+    return (red << 16) | (green << 8) | blue
+
+
+def unpack(color):
+    """Split a packed 24-bit color into red, green and blue"""
+    return (color >> 16) & 0xFF, (color >> 8) & 0xFF, color & 0xFF
+
+
+def gamma_table(gamma=LED_GAMMA):
+    """256-entry lookup table for a gamma curve, built once per gamma"""
+    try:
+        return _gamma_tables[gamma]
+    except KeyError:
+        table = bytes(int(round(255 * (level / 255.0) ** gamma)) for level in range(256))
+        _gamma_tables[gamma] = table
+        return table
+
+
+def adjust(color, brightness=255, gamma=None):
+    """Scale a color to brightness (0-255), then gamma-correct it if gamma is set
+    :param color: packed color, or a (red, green, blue) sequence
+    :return: packed color
+    """
+    red, green, blue = unpack(color) if isinstance(color, int) else color
+    if brightness != 255:
+        red = red * brightness // 255
+        green = green * brightness // 255
+        blue = blue * brightness // 255
+    if gamma is not None:
+        table = gamma_table(gamma)
+        red, green, blue = table[red], table[green], table[blue]
+    return pack(red, green, blue)
+
+
+def gradient(start, end, count, brightness=255, gamma=None):
+    """Table of count colors running evenly from start to end, inclusive
+    :param start: packed color, or a (red, green, blue) sequence
+    :param end: packed color, or a (red, green, blue) sequence
+    :param count: int, number of LEDs
+    :return: array('I') of packed colors
+    """
+    start = unpack(start) if isinstance(start, int) else tuple(start)
+    end = unpack(end) if isinstance(end, int) else tuple(end)
+    steps = max(1, count - 1)
+    return array('I', (adjust([int(round(a + (b - a) * index / float(steps)))
+                               for a, b in zip(start, end)], brightness, gamma)
+                        for index in range(count)))
+
+
+def solid(color, count, brightness=255, gamma=None):
+    """Table of count copies of one color"""
+    return array('I', [adjust(color, brightness, gamma)]) * count
+
+
+def from_rgb_list(color_list, brightness=255, gamma=None):
+    """Table from a list of [red, green, blue] lists, like FRESH_COLORS used to be"""
+    return array('I', (adjust(color, brightness, gamma) for color in color_list))
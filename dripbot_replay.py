@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+
+"""
+Replay button-press scenarios against DripBot on simulated hardware.
+
+Runs dripbot_master.main() on a SimulatedGPIO and VirtualStrip, posting
+to a local stand-in for the Mattermost webhook, and drives the button
+through each scenario with SimulatedGPIO.play(). Reports press-to-post
+latency for the scenarios that should post, how many of them never did,
+and the intervals between frames pushed to the strip.
+
+Scenarios are generated from a seed, a mix of bouncy taps, holds and
+presses too short to count:
+
+    python3 dripbot_replay.py --count 2000 --seed 1
+
+or read from a JSON file: a list of objects with "steps", the
+[seconds to wait, level] pairs for play(), and "posts", whether the
+scenario should end in a post:
+
+    [{"steps": [[0, 0], [0.2, 1]], "posts": true}]
+
+The button timings are shortened for the run (see REPLAY_STATION), so
+thousands of scenarios take minutes rather than hours. Use --json to
+write the results to a file, to diff between releases.
+"""
+
+import argparse
+import http.server
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+# Station settings for the run: short enough to get through thousands of
+# presses, with the same proportions as the real ones
+REPLAY_STATION = {
+    'button_debounce': 0.005,
+    'button_tap': 0.02,
+    'button_hold': 0.3,
+    'button_cooldown': 0.05,
+    'dash_delay_minutes': 0.005,   # 0.3 s brewing delay for a hold
+}
+
+# Seconds to wait after each scenario, for the cooldown to pass
+SETTLE = 0.1
+
+# Frame intervals longer than this are the ring sitting still between
+# animations, not frame timing
+IDLE_GAP = 0.5
+
+# -------------------------
+# Argument setup
+# -------------------------
+
+parser = argparse.ArgumentParser(
+    prog='python3 dripbot_replay.py',
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    description='Replay button-press scenarios against DripBot on simulated hardware.')
+parser.add_argument(
+    '-n',
+    '--count',
+    type=int,
+    default=200,
+    help='Scenarios to generate',
+    )
+parser.add_argument(
+    '-s',
+    '--seed',
+    type=int,
+    default=1,
+    help='Seed for the generated scenarios',
+    )
+parser.add_argument(
+    '-f',
+    '--file',
+    type=str,
+    help='Read the scenarios from this JSON file instead of generating them',
+    )
+parser.add_argument(
+    '-t',
+    '--timeout',
+    type=float,
+    default=2.0,
+    help='Seconds to wait for a scenario\'s post before counting it missed',
+    )
+parser.add_argument(
+    '--json',
+    metavar='PATH',
+    help='Also write the results as JSON to PATH ("-" for stdout)',
+    )
+
+
+def generate(count, seed=1):
+    """
+    Scenarios for SimulatedGPIO.play(): bouncy taps, holds long enough
+    for a drip-n-dash, and presses too short to count.
+    :return: list of {"kind", "steps", "posts"} dictionaries
+    """
+    rng = random.Random(seed)
+    low, high = 0, 1
+    scenarios = []
+    for _ in range(count):
+        kind = rng.choices(('tap', 'hold', 'short'), weights=(7, 1, 2))[0]
+        if kind == 'tap':
+            hold = rng.uniform(0.04, 0.25)
+        elif kind == 'hold':
+            hold = rng.uniform(REPLAY_STATION['button_hold'] + 0.05, 0.5)
+        else:
+            hold = rng.uniform(0.002, REPLAY_STATION['button_tap'] / 2)
+        steps = []
+        # Contact bounce: quick toggles, each shorter than the debounce window
+        for _ in range(rng.randrange(4)):
+            steps += [(rng.uniform(0, 0.002), low), (rng.uniform(0, 0.002), high)]
+        steps += [(0.0, low), (hold, high)]
+        scenarios.append({'kind': kind, 'steps': steps, 'posts': kind != 'short'})
+    return scenarios
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def distribution(values):
+    """Count, p50, p99 and max of a list of seconds, in milliseconds"""
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'p50_ms': percentile(values, 0.50) * 1e3,
+        'p99_ms': percentile(values, 0.99) * 1e3,
+        'max_ms': values[-1] * 1e3 if values else 0.0,
+    }
+
+
+class Receiver(object):
+    """Local stand-in for the Mattermost webhook, noting when each post arrives"""
+
+    def __init__(self):
+        self.posts = []  # monotonic time of each post
+        self.condition = threading.Condition()
+        receiver = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers['Content-Length']))
+                with receiver.condition:
+                    receiver.posts.append(time.monotonic())
+                    receiver.condition.notify_all()
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        threading.Thread(target=self.server.serve_forever, name='ReplayWebhook',
+                         daemon=True).start()
+
+    def wait_for(self, count, timeout):
+        """Wait until count posts have arrived
+        :return: monotonic time of post number count, or None on timeout
+        """
+        with self.condition:
+            if self.condition.wait_for(lambda: len(self.posts) >= count, timeout):
+                return self.posts[count - 1]
+        return None
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def replay(scenarios, timeout=2.0):
+    """
+    Run DripBot on simulated hardware and play every scenario to it.
+    :return: dictionary of results
+    """
+    import dripbot_hardware
+    import dripbot_master
+
+    workdir = tempfile.mkdtemp(prefix='dripbot-replay-')
+    station = dict(REPLAY_STATION, checkpoint_file=os.path.join(workdir, 'drip.checkpoint.json'))
+    stations_file = os.path.join(workdir, 'stations.json')
+    with open(stations_file, 'w') as stations_out:
+        json.dump({'stations': [station]}, stations_out)
+    dripbot_master.STATIONS_FILE = stations_file
+    dripbot_master.LOG_FILE = os.path.join(workdir, 'drip.log')
+    dripbot_master.METRICS_PORT = None
+
+    receiver = Receiver()
+    hardware = dripbot_hardware.load('sim')
+    gpio = hardware.GPIO
+    shutdown = threading.Event()
+    runner = threading.Thread(target=dripbot_master.main, name='DripBot',
+                              kwargs={'hardware': hardware, 'webhook_url': receiver.url,
+                                      'install_signals': False, 'shutdown': shutdown})
+    runner.start()
+    # Wait for the messaging to be set up, so the first press isn't billed for it
+    while dripbot_master.drip is None:
+        time.sleep(0.01)
+    pin = dripbot_master.stations[0].button.pin
+
+    latencies = {}
+    missed = 0
+    extra = 0
+    posted = 0
+    started = time.perf_counter()
+    for scenario in scenarios:
+        first_edge = len(gpio.edges)
+        gpio.play(pin, scenario['steps'])
+        pressed_at = next(timestamp for timestamp, _, level in gpio.edges[first_edge:]
+                          if level == gpio.LOW)
+        if scenario['posts']:
+            posted_at = receiver.wait_for(posted + 1, timeout)
+            if posted_at is None:
+                missed += 1
+            else:
+                posted += 1
+                latencies.setdefault(scenario.get('kind', 'press'), []).append(
+                    posted_at - pressed_at)
+        time.sleep(SETTLE)
+        # A scenario that shouldn't have posted, but did
+        with receiver.condition:
+            while len(receiver.posts) > posted:
+                posted += 1
+                extra += 1
+    elapsed = time.perf_counter() - started
+
+    shutdown.set()
+    runner.join()
+    receiver.close()
+
+    strip = hardware.strips[0]
+    intervals = [interval for interval in strip.frame_intervals() if interval < IDLE_GAP]
+    results = {
+        'python': sys.version.split()[0],
+        'scenarios': len(scenarios),
+        'seconds': elapsed,
+        'missed': missed,
+        'extra': extra,
+        'press_to_post': distribution([value for values in latencies.values()
+                                       for value in values]),
+        'frames': dict(distribution(intervals), target_ms=1e3 / dripbot_master.LED_FPS,
+                       shown=len(strip.frames)),
+    }
+    for kind, values in sorted(latencies.items()):
+        results['press_to_post_' + kind] = distribution(values)
+    return results
+
+
+def main(argv=None):
+    """Parse the arguments, replay the scenarios and report
+    :return: exit status; 1 if any scenario missed its post or posted when it shouldn't
+    """
+    args = parser.parse_args(argv)
+    if args.file:
+        with open(args.file) as scenarios_file:
+            scenarios = json.load(scenarios_file)
+    else:
+        scenarios = generate(args.count, args.seed)
+
+    results = replay(scenarios, args.timeout)
+
+    if args.json == '-':
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+    else:
+        print('{} scenarios in {:.1f} s, {} missed, {} extra'.format(
+            results['scenarios'], results['seconds'], results['missed'], results['extra']))
+        for name in sorted(results):
+            if name.startswith('press_to_post') or name == 'frames':
+                result = results[name]
+                print('{:<20} {:6d}   p50 {:7.1f} ms   p99 {:7.1f} ms   max {:7.1f} ms'.format(
+                    name, result['count'], result['p50_ms'], result['p99_ms'],
+                    result['max_ms']))
+        if args.json:
+            with open(args.json, 'w') as json_file:
+                json.dump(results, json_file, indent=2, sort_keys=True)
+    return 1 if results['missed'] or results['extra'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
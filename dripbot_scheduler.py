@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+"""Single-thread timer scheduler for DripBot.
+
+One thread runs every scheduled call, in deadline order, from a
+priority queue keyed on the monotonic clock. Calls can be cancelled or
+rescheduled through the handle that schedule() returns, so no thread is
+created per timer, and since all calls run on the one thread, they
+never run concurrently with each other.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger('dripbot')
+
+
+class ScheduledCall(object):
+    """Handle for a call in the Scheduler"""
+
+    __slots__ = ('function', 'args', 'when', 'seq', 'cancelled')
+
+    def __init__(self, function, args):
+        self.function = function
+        self.args = args
+        self.when = None
+        self.seq = None
+        self.cancelled = False
+
+    def __repr__(self):
+        return '<ScheduledCall {} at {} {}>'.format(
+            getattr(self.function, '__name__', self.function), self.when,
+            'cancelled' if self.cancelled else 'pending' if self.seq is not None else 'done')
+
+
+class Scheduler(object):
+    """
+    Runs calls at given delays on a single thread.
+    """
+
+    def __init__(self, name='DripScheduler'):
+        self.name = name
+        self._queue = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def start(self):
+        """Start the scheduler thread"""
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the scheduler thread; pending calls are dropped"""
+        with self._condition:
+            self._stopped = True
+            self._queue = []
+            self._condition.notify()
+            thread, self._thread = self._thread, None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _push(self, handle, delay):
+        """Queue handle to run after delay seconds; caller holds the lock"""
+        handle.when = time.monotonic() + max(0.0, delay)
+        handle.seq = next(self._counter)
+        heapq.heappush(self._queue, (handle.when, handle.seq, handle))
+        self._condition.notify()
+
+    def schedule(self, delay, function, *args):
+        """Run function(*args) after delay seconds
+        :return: ScheduledCall handle
+        """
+        handle = ScheduledCall(function, args)
+        with self._condition:
+            self._push(handle, delay)
+        return handle
+
+    def call_soon(self, function, *args):
+        """Run function(*args) on the scheduler thread as soon as possible"""
+        return self.schedule(0.0, function, *args)
+
+    def cancel(self, handle):
+        """Cancel a scheduled call; None and finished calls are ignored"""
+        if handle is None:
+            return
+        with self._condition:
+            handle.cancelled = True
+            handle.seq = None
+
+    def reschedule(self, handle, delay):
+        """Run a pending or finished call again after delay seconds,
+        replacing any pending run of it.
+        :return: False if the call was cancelled, else True
+        """
+        with self._condition:
+            if handle.cancelled:
+                return False
+            self._push(handle, delay)
+            return True
+
+    def pending(self):
+        """Number of calls waiting to run"""
+        with self._condition:
+            return sum(1 for _, seq, handle in self._queue if seq == handle.seq)
+
+    def _run(self):
+        """Scheduler thread: sleep until the earliest deadline, then run it"""
+        while True:
+            with self._condition:
+                while True:
+                    if self._stopped:
+                        return
+                    # Drop entries that were cancelled or superseded by a reschedule
+                    while self._queue and self._queue[0][1] != self._queue[0][2].seq:
+                        heapq.heappop(self._queue)
+                    if not self._queue:
+                        self._condition.wait()
+                        continue
+                    wait = self._queue[0][0] - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._condition.wait(wait)
+                _, _, handle = heapq.heappop(self._queue)
+                handle.seq = None
+            try:
+                handle.function(*handle.args)
+            except Exception:
+                logger.exception("Scheduled call %r failed", handle)
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+
+"""Coffee stations for DripBot.
+
+A Station is one coffee pot: its button, its segment of the LED strip,
+its freshness countdown and checkpoint, and the channel and wording of
+its announcements. Stations share everything that costs a thread or a
+connection: one Scheduler runs every station's button and timers, one
+Animator renders every ring segment with a single show() per frame, and
+one Webhook sends for all of them.
+
+Stations are configured from a JSON file:
+
+    {
+        "defaults": {"countdown_minutes": 90},
+        "stations": [
+            {"name": "kitchen", "button_pin": 24, "led_start": 0, "led_count": 16,
+             "channel": "kitchen"},
+            {"name": "lobby", "button_pin": 23, "led_start": 16, "led_count": 12,
+             "channel": "lobby", "message": "{phrase} (lobby)"}
+        ]
+    }
+
+Settings not given for a station come from "defaults", then from the
+defaults that dripbot_master passes in.
+"""
+
+import json
+import logging
+import time
+
+from dripbot_animation import OFF, color_wipe, ring_flash, set_pixel, show_frame, timer_setup
+from dripbot_button import Button
+from dripbot_checkpoint import Checkpoint, elapsed_seconds
+from dripbot_palette import gradient, pack, solid
+
+logger = logging.getLogger('dripbot')
+
+# Colors for the Fresh Drip timer ring: cyan to magenta
+FRESH_START = (0, 200, 200)
+FRESH_END = (200, 0, 200)
+# Colors for the Drip-n-Dash delay function
+DRIPDASH_COLOR = pack(200, 160, 0)
+READY_COLOR = pack(0, 0, 255)
+ERROR_COLOR = pack(255, 0, 0)
+
+# Every setting a station has, and its default
+SETTINGS = {
+    'name': 'dripbot',
+    'button_pin': 24,
+    'button_debounce': 0.02,    # seconds the level must be steady to count as an edge
+    'button_tap': 0.1,          # seconds; shorter presses are rejected
+    'button_hold': 1.0,         # seconds; a press this long is a drip-n-dash
+    'button_cooldown': 1.0,     # seconds after a press before the next
+    'led_start': 0,             # first pixel of the station's ring on the strip
+    'led_count': 16,
+    'countdown_minutes': 120,   # freshness countdown after an announcement
+    'dash_delay_minutes': 5,    # brewing delay before a drip-n-dash announcement
+    'channel': None,            # None for the webhook's default
+    'username': None,
+    'icon_url': None,
+    'message': '{phrase}',      # {phrase} and {name} are filled in
+    'checkpoint_file': 'drip.checkpoint.json',
+}
+
+
+def station_settings(stations, defaults=None):
+    """
+    Complete and check the settings for a list of stations.
+    :param stations: list of dictionaries of station settings
+    :param defaults: dictionary of settings for every station
+    :return: list of complete settings dictionaries
+    :raise ValueError: unknown settings, or stations that share a name,
+                       pin, checkpoint file or LEDs
+    """
+    base = dict(SETTINGS)
+    base.update(defaults or {})
+    complete = []
+    for index, station in enumerate(stations):
+        settings = dict(base)
+        settings.update(station)
+        unknown = set(settings) - set(SETTINGS)
+        if unknown:
+            raise ValueError('Unknown station settings: {}'.format(', '.join(sorted(unknown))))
+        if len(stations) > 1 and 'name' not in station:
+            settings['name'] = 'station{}'.format(index + 1)
+        if len(stations) > 1 and 'checkpoint_file' not in station:
+            settings['checkpoint_file'] = 'drip.checkpoint.{}.json'.format(settings['name'])
+        complete.append(settings)
+
+    for key in ('name', 'button_pin', 'checkpoint_file'):
+        values = [settings[key] for settings in complete]
+        if len(set(values)) != len(values):
+            raise ValueError('Stations must not share a {}'.format(key))
+    taken = set()
+    for settings in complete:
+        pixels = set(range(settings['led_start'], settings['led_start'] + settings['led_count']))
+        if pixels & taken:
+            raise ValueError('Station {} overlaps the LEDs of another'.format(settings['name']))
+        taken |= pixels
+    return complete
+
+
+def load_stations(path, defaults=None):
+    """Station settings from a JSON file; see station_settings()"""
+    with open(path) as stations_file:
+        config = json.load(stations_file)
+    base = dict(defaults or {})
+    base.update(config.get('defaults', {}))
+    return station_settings(config['stations'], base)
+
+
+class Station(object):
+    """
+    One button, ring segment and countdown, announcing to one channel.
+    """
+
+    def __init__(self, settings, gpio, scheduler, animator, metrics, on_press=None):
+        """
+        :param settings: complete settings, from station_settings()
+        :param gpio: RPi.GPIO, or a simulated one from dripbot_hardware
+        :param scheduler: Scheduler shared by every station
+        :param animator: Animator shared by every station
+        :param metrics: Metrics shared by every station
+        :param on_press: callable(station), run for each accepted press
+        """
+        self.settings = settings
+        self.name = settings['name']
+        self.channel = settings['channel']
+        self.username = settings['username']
+        self.icon_url = settings['icon_url']
+        self.message = settings['message']
+        self.countdown_minutes = settings['countdown_minutes']
+        self.dash_delay_minutes = settings['dash_delay_minutes']
+        self.scheduler = scheduler
+        self.metrics = metrics
+        self.on_press = on_press
+        self.ring = animator.ring(settings['led_start'], settings['led_count'])
+        self.led_count = settings['led_count']
+        # Color tables are built once here, for however many LEDs there are
+        self.fresh_colors = gradient(FRESH_START, FRESH_END, self.led_count)
+        self.dripdash_colors = solid(DRIPDASH_COLOR, self.led_count)
+        self.checkpoint = Checkpoint(settings['checkpoint_file'], scheduler)
+        self.button = Button(gpio, settings['button_pin'], scheduler, self.tapped, self.held,
+                             debounce=settings['button_debounce'], tap=settings['button_tap'],
+                             hold=settings['button_hold'], cooldown=settings['button_cooldown'])
+        # Set by connect(), once the messaging is loaded
+        self.dripbot = None
+        self.spool = None
+        self.drip = None
+        # Scheduler handle for the next LED step of the countdown; a
+        # drip-n-dash countdown announces the coffee from its last step
+        self.drip_timer = None
+        self.countdown_mode = 'fresh'
+        # Bumped by each press; a send's result only counts if no press
+        # has come since it went out
+        self.generation = 0
+        self.time_between_leds = 0
+        self.current_led = 0
+
+    def __repr__(self):
+        return '<Station {}>'.format(self.name)
+
+    def start(self):
+        """Watch the button"""
+        self.button.start()
+        for name in ('taps', 'holds', 'rejected', 'bounces'):
+            self.metrics.register('button_' + name, lambda name=name: getattr(self.button, name),
+                                  'button presses: ' + name, kind='counter',
+                                  labels={'station': self.name})
+
+    def show_ready(self):
+        """Flash the ring to show the station is ready. After a restart, the
+        ring shows the countdown that was running instead.
+        """
+        if not self.resume():
+            self.ring.play(ring_flash(READY_COLOR, flashes=10, wait_ms=100))
+
+    def stop(self):
+        """Stop watching the button; call flush() once the scheduler has stopped"""
+        self.button.stop()
+        logger.info("%s button presses: %s", self.name, self.button.stats())
+
+    def flush(self):
+        self.checkpoint.flush()
+
+    def connect(self, dripbot, spool, drip):
+        """
+        Hand the station the shared messaging.
+        :param dripbot: Webhook
+        :param spool: Spool, or None to send directly
+        :param drip: PhrasePool
+        """
+        self.dripbot = dripbot
+        self.spool = spool
+        self.drip = drip
+
+    # Everything below runs on the scheduler thread
+
+    def tapped(self):
+        """Fresh drip: user momentary tap on button"""
+        logger.debug("%s tapped", self.name)
+        self._accepted()
+        with self.metrics.span('button_handler'):
+            self.fresh(self.button.last_press)
+
+    def held(self):
+        """
+        GRUBER'D!
+        User holds button until they see LEDs change
+        """
+        logger.debug("%s held", self.name)
+        self._accepted()
+        with self.metrics.span('button_handler'):
+            self.drip_dash()
+
+    def _accepted(self):
+        self.metrics.observe('button_debounce', self.button.last_decided)
+        if self.on_press is not None:
+            self.on_press(self)
+
+    def cancel_timers(self):
+        """Cancel the countdown, any pending drip-n-dash announcement, and
+        the result of any send still in flight"""
+        self.generation += 1
+        self.scheduler.cancel(self.drip_timer)
+        self.checkpoint.clear()
+
+    def drip_dash(self):
+        """Start the timer on a delay while it brews"""
+        logger.debug("%s drip_dash()", self.name)
+        # A new press supersedes any countdown or announcement in progress
+        self.cancel_timers()
+
+        # Animate lights (flashing) to indicate user has held button long enough
+        self.ring.play(ring_flash(DRIPDASH_COLOR, flashes=10, wait_ms=100), preempt=True)
+
+        # Animate lights (animate to full)
+        self.ring.play(timer_setup(self.dripdash_colors, wait_ms=50))
+
+        # Count down the delay for brewing; the last LED going out
+        # triggers fresh()
+        self.scheduler.call_soon(self.drip_countdown, self.dash_delay_minutes, 'dash')
+
+    def fresh(self, pressed_at=None):
+        """
+        There is a fresh pot of coffee
+        :param pressed_at: monotonic time of the button press, if one led here
+        """
+        logger.debug("%s fresh()", self.name)
+        # A new press supersedes any countdown or announcement in progress
+        self.cancel_timers()
+
+        # Animate lights (animate to full); the render thread plays it
+        # while the message goes out
+        setup_start = time.monotonic()
+        self.ring.play(timer_setup(self.fresh_colors, wait_ms=50), preempt=True,
+                       on_done=lambda: self.metrics.observe('timer_setup', setup_start))
+
+        # Get a set of fresh drip nonsense words
+        # A pop from the pool; generating the phrase is timed by the pool
+        with self.metrics.span('phrase_pop'):
+            phrase = self.drip.fresh_drip()
+        message = self.message.format(phrase=phrase, name=self.name)
+
+        if self.spool is not None:
+            # The spool delivers it, retrying until the server accepts it
+            self.spool.put(message, self.channel, self.icon_url, self.username)
+            logger.info("%s drip spooled.", self.name)
+            self.scheduler.call_soon(self.drip_countdown, self.countdown_minutes)
+            return
+
+        # Send message to Mattermost, without holding up the scheduler;
+        # drip_sent shows the result when the send completes
+        send_start = time.monotonic()
+        generation = self.generation
+        self.dripbot.send_async(
+            message, self.channel, self.icon_url, self.username,
+            callback=lambda future: self.drip_sent(future, send_start, pressed_at, generation))
+
+    def drip_sent(self, future, send_start, pressed_at=None, generation=None):
+        """The fresh drip message has been sent, or has failed.
+        Runs on the webhook's sender thread, or on the scheduler thread if
+        the send finished before send_async returned; either way, the
+        ring is left to drip_shown(), on the scheduler thread.
+        """
+        # From queueing the send, so it includes any wait behind earlier sends
+        self.metrics.observe('send_queued_to_done', send_start)
+        error = future.exception()
+        if error is None:
+            if pressed_at is not None:
+                self.metrics.observe('press_to_post', pressed_at)
+            logger.info("%s drip sent.", self.name)
+        else:
+            logger.error("%s error sending: %s", self.name, error)
+        self.scheduler.call_soon(self.drip_shown, error, generation)
+
+    def drip_shown(self, error, generation=None):
+        """Start the countdown for a sent message, or show the error,
+        unless a newer press has taken over the ring"""
+        if generation is not None and generation != self.generation:
+            logger.debug("%s send result superseded by a newer press", self.name)
+            return
+        if error is None:
+            # Start light timer for next hour
+            self.drip_countdown(self.countdown_minutes)
+        else:
+            self.ring.play(color_wipe(ERROR_COLOR), preempt=True)
+
+    def drip_countdown(self, timer_min=60, mode='fresh', start=None):
+        """
+        Schedule the "count down" that turns off the ring lights
+        over a period of time, and checkpoint it.
+        :param mode: 'fresh', or 'dash' to announce the coffee at the end
+        :param start: time.time() a resumed countdown started at; now for a new one
+        """
+        logger.debug("%s drip_countdown()", self.name)
+        self.scheduler.cancel(self.drip_timer)
+        self.countdown_mode = mode
+        # Time in seconds between LEDs extinguished
+        self.time_between_leds = timer_min * 60.0 / self.led_count
+        # Start at the first LED, or wherever a resumed countdown has got
+        # to by now; one that ran out meanwhile finishes with its last step
+        elapsed = 0.0
+        if start is None:
+            start = time.time()
+        else:
+            elapsed = max(0.0, time.time() - start)
+        self.current_led = min(int(elapsed // self.time_between_leds), self.led_count - 1)
+        if self.current_led:
+            colors = self.dripdash_colors if mode == 'dash' else self.fresh_colors
+            self.ring.play(show_frame([OFF] * self.current_led + list(colors[self.current_led:])))
+        self.checkpoint.save(mode, start, timer_min * 60.0)
+        self.drip_timer = self.scheduler.schedule(
+            (self.current_led + 1) * self.time_between_leds - elapsed, self.drip_countdown_step)
+
+    def drip_countdown_step(self):
+        """Turn off one more light on the LED ring"""
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("%s countdown: LED %d, %.1f s apart, %r, frame %s", self.name,
+                         self.current_led, self.time_between_leds, self.drip_timer,
+                         self.ring.frame)
+        # Turn off the current LED
+        self.ring.play(set_pixel(self.current_led, OFF))
+        self.current_led += 1
+        if self.current_led == self.led_count:
+            # We've turned them all off
+            self.checkpoint.clear()
+            if self.countdown_mode == 'dash':
+                # The brewing delay is over
+                self.fresh()
+            return
+        # Does nothing if a new press cancelled the countdown meanwhile
+        self.scheduler.reschedule(self.drip_timer, self.time_between_leds)
+
+    def resume(self):
+        """
+        Put back a countdown that was running when DripBot stopped: show the
+        ring as it should be now, in one frame, and schedule the rest.
+        :return: True if there was one to resume
+        """
+        state = self.checkpoint.load()
+        if state is None:
+            return False
+        elapsed = elapsed_seconds(state)
+        if elapsed is None:
+            # It finished while we were stopped. A drip-n-dash that did is
+            # still announced, unless the coffee would no longer be fresh
+            late = time.time() - state['start'] - state['duration']
+            if state['mode'] == 'dash' and 0 <= late < self.countdown_minutes * 60:
+                logger.warning("%s drip-n-dash delay ran out %.0f s ago, while stopped; "
+                               "announcing it now.", self.name, late)
+                self.scheduler.call_soon(self.fresh)
+                return True
+            if state['mode'] == 'dash':
+                logger.warning("%s drip-n-dash delay ran out %.0f s ago, while stopped; "
+                               "too late to announce, dropped.", self.name, late)
+            self.scheduler.call_soon(self.checkpoint.clear)
+            return False
+        colors = self.dripdash_colors if state['mode'] == 'dash' else self.fresh_colors
+        done = int(elapsed * self.led_count // state['duration'])
+        self.ring.play(show_frame([OFF] * done + list(colors[done:])), preempt=True)
+        # The countdown works out how far it has got when it runs, which
+        # is after the messaging has been set up
+        self.scheduler.call_soon(self.drip_countdown, state['duration'] / 60.0, state['mode'],
+                                 state['start'])
+        logger.info("%s resumed %s countdown, %d of %d LEDs out.", self.name, state['mode'],
+                    done, self.led_count)
+        return True
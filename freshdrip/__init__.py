@@ -1,3 +1,5 @@
 from freshdrip.freshdrip import DripWords
+from freshdrip.model import DripModel, NoWordError, load_model
+from freshdrip.pool import PhrasePool
 
-__all__ = ['DripWords']
\ No newline at end of file
+__all__ = ['DripWords', 'DripModel', 'NoWordError', 'load_model', 'PhrasePool']
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+
+"""Benchmark the "fresh drip" word generator
+
+Runs fully offline against the bundled data files and reports model
+load time, phrases per second, p50/p99 latency per phrase and peak
+traced memory for:
+
+    load_json       DripModel.from_json
+    load_compiled   MappedModel.open, if data/ngrams.bin exists
+    warm            building the end-letter index for every "d…p" length,
+                    the one-off cost a cold model pays on its first draws
+    fresh_drip      DripWords.fresh_drip, one phrase per call
+    drip_word       the end-constrained "d…p" word on its own
+    legacy_tables   single_syllable_word with raw JSON bigram and trigram
+                    dictionaries, as the original generator was called
+    batch           DripWords.fresh_drip_many
+
+The per-call benchmarks run on a warmed model, so their p99 is not
+billed for the index builds; those are reported once, under warm.
+
+Use --json to write the results to a file, to diff between releases:
+
+    python3 -m freshdrip.benchmark --json bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from freshdrip.compiled import COMPILED_FILE, MappedModel, is_stale
+from freshdrip.freshdrip import DripWords
+from freshdrip.model import BIGRAMS_FILE, DATA_DIR, TRIGRAMS_FILE, DripModel, NoWordError
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def traced_peak(function, count=1):
+    """Peak traced memory, in KiB, of calling function count times.
+    Kept apart from the timed runs, since tracing slows every allocation.
+    """
+    tracemalloc.start()
+    for _ in range(count):
+        function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024.0
+
+
+def time_calls(function, count):
+    """Call function count times, timing each call
+    :return: dictionary of throughput, latency and peak memory
+    """
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(count):
+        call_started = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'count': count,
+        'seconds': elapsed,
+        'per_second': count / elapsed if elapsed else 0.0,
+        'p50_us': percentile(latencies, 0.50) * 1e6,
+        'p99_us': percentile(latencies, 0.99) * 1e6,
+        'peak_kib': traced_peak(function, min(count, 100)),
+    }
+
+
+def time_load(function, repeat):
+    """Time loading a model; the best of repeat runs, and its peak memory"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return {'repeat': repeat, 'best_ms': best * 1e3, 'peak_kib': traced_peak(function)}
+
+
+def warm(model, start='D', end='P', max_length=DripWords.MAX_WORD_LENGTH):
+    """Build every end-letter sampler a start…end word can need"""
+    tails = list(model.tails())
+    for steps in range(1, max(max_length, 3) - 1):
+        for draw in [lambda: model.start_bigram_to(start, end, steps)] + [
+                lambda tail=tail: model.next_letter_to(tail, end, steps) for tail in tails]:
+            try:
+                draw()
+            except NoWordError:
+                pass
+
+
+def run(count=2000, batch=10000, seed=1, model='auto', repeat=5):
+    """Run every benchmark
+    :param count: int, phrases for the per-call benchmarks
+    :param batch: int, phrases for the batch benchmark
+    :param seed: int, seed for the random draws
+    :param model: 'json', 'compiled' or 'auto' (compiled if current)
+    :param repeat: int, model loads to take the best of
+    :return: dictionary of results
+    """
+    compiled_path = os.path.join(DATA_DIR, COMPILED_FILE)
+    compiled_ok = os.path.exists(compiled_path) and not is_stale(compiled_path)
+    if model == 'compiled' and not compiled_ok:
+        raise SystemExit('{} is missing or stale; run python3 -m freshdrip.compiled'.format(
+            compiled_path))
+
+    results = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'seed': seed,
+        'load_json': time_load(DripModel.from_json, repeat),
+    }
+    if compiled_ok:
+        results['load_compiled'] = time_load(lambda: MappedModel.open(compiled_path), repeat)
+
+    use_compiled = model == 'compiled' or (model == 'auto' and compiled_ok)
+    drip_model = MappedModel.open(compiled_path) if use_compiled else DripModel.from_json()
+    results['model'] = 'compiled' if use_compiled else 'json'
+
+    words = DripWords(drip_model, random.Random(seed))
+    # The end-letter index is built lazily; build it all now, timed on its
+    # own, so it is not billed to the first calls below
+    started = time.perf_counter()
+    warm(drip_model)
+    results['warm'] = {'ms': (time.perf_counter() - started) * 1e3}
+
+    results['fresh_drip'] = time_calls(words.fresh_drip, count)
+
+    def drip_word():
+        words.word_to('d', 'p', drip_model.word_length(DripWords.MAX_WORD_LENGTH, words.rng))
+    results['drip_word'] = time_calls(drip_word, count)
+
+    # The tables as the original generator read them, with string weights
+    with open(os.path.join(DATA_DIR, BIGRAMS_FILE)) as bigrams_file:
+        bigrams = json.load(bigrams_file)
+    with open(os.path.join(DATA_DIR, TRIGRAMS_FILE)) as trigrams_file:
+        trigrams = json.load(trigrams_file)
+
+    def legacy_tables():
+        length = drip_model.word_length(DripWords.MAX_WORD_LENGTH, words.rng)
+        words.single_syllable_word(bigrams, 'f', length, trigrams)
+        length = drip_model.word_length(DripWords.MAX_WORD_LENGTH, words.rng)
+        try:
+            words.single_syllable_word(bigrams, 'd', length, trigrams, 'p')
+        except NoWordError:
+            pass
+    # Builds, then keeps, the model for these tables, and warms its index
+    warm(words.model_for(bigrams, trigrams))
+    results['legacy_tables'] = time_calls(legacy_tables, count)
+
+    started = time.perf_counter()
+    words.fresh_drip_many(batch)
+    elapsed = time.perf_counter() - started
+    results['batch'] = {
+        'count': batch,
+        'seconds': elapsed,
+        'per_second': batch / elapsed if elapsed else 0.0,
+        'peak_kib': traced_peak(lambda: words.fresh_drip_many(batch)),
+    }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python3 -m freshdrip.benchmark',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Benchmark fresh drip phrase generation.')
+    parser.add_argument('-n', '--count', type=int, default=2000,
+                        help='Phrases for the per-call benchmarks')
+    parser.add_argument('-b', '--batch', type=int, default=10000,
+                        help='Phrases for the batch benchmark')
+    parser.add_argument('-s', '--seed', type=int, default=1,
+                        help='Seed for the random draws')
+    parser.add_argument('-m', '--model', choices=('auto', 'json', 'compiled'), default='auto',
+                        help='Model to generate from')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Model loads to take the best of')
+    parser.add_argument('--json', metavar='PATH',
+                        help='Also write the results as JSON to PATH ("-" for stdout)')
+    args = parser.parse_args(argv)
+
+    results = run(args.count, args.batch, args.seed, args.model, args.repeat)
+
+    if args.json == '-':
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+        return 0
+
+    print('model: {}  python: {}  machine: {}'.format(
+        results['model'], results['python'], results['machine']))
+    for name in ('load_json', 'load_compiled'):
+        if name in results:
+            print('{:<14} best {:8.2f} ms   peak {:9.1f} KiB'.format(
+                name, results[name]['best_ms'], results[name]['peak_kib']))
+    print('{:<14} {:8.2f} ms'.format('warm', results['warm']['ms']))
+    for name in ('fresh_drip', 'drip_word', 'legacy_tables'):
+        result = results[name]
+        print('{:<14} {:9.0f}/s   p50 {:7.1f} us   p99 {:7.1f} us   peak {:9.1f} KiB'.format(
+            name, result['per_second'], result['p50_us'], result['p99_us'], result['peak_kib']))
+    print('{:<14} {:9.0f}/s   {} phrases in {:.2f} s   peak {:9.1f} KiB'.format(
+        'batch', results['batch']['per_second'], results['batch']['count'],
+        results['batch']['seconds'], results['batch']['peak_kib']))
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+
+"""Compiled, memory-mapped n-gram model
+
+The JSON files in ``data/`` stay the source of truth. This module packs
+them into one compact binary file, ``data/ngrams.bin``, and loads that
+file with mmap, so the model is a handful of flat arrays in the page
+cache rather than thousands of small Python dicts and strings.
+
+Build it after changing the JSON:
+
+    python3 -m freshdrip.compiled
+
+Layout, little-endian, every section aligned to 8 bytes:
+
+    header          magic b'DRIP', version, reserved (4s H H)
+                    n_lengths, n_transitions, n_bigrams (I I I, pad to 8)
+    length_cum      n_lengths x uint64, running total of length weights
+    tail_index      676 x (offset, count) uint32, by tail id 26 * a + b
+    trans_letters   n_transitions x uint8, letter following the tail
+    trans_cum       n_transitions x uint64, running total within each tail
+    start_index     26 x (offset, count) uint32, by first letter
+    bigram_letters  n_bigrams x 2 uint8, start bigrams
+    bigram_cum      n_bigrams x uint64, running total within each letter
+
+Zero weights are dropped from the trigram and bigram sections; otherwise
+entries keep their JSON order, so a seeded run draws the same words from
+either model.
+"""
+
+import argparse
+import bisect
+import json
+import mmap
+import os
+import random
+import struct
+import sys
+
+from freshdrip.model import (DATA_DIR, JSON_FILES, LENGTHS_FILE, BIGRAMS_FILE,
+                             TRIGRAMS_FILE, NgramModel)
+from freshdrip.sampler import WeightedSampler
+
+COMPILED_FILE = 'ngrams.bin'
+MAGIC = b'DRIP'
+VERSION = 1
+
+_HEADER = struct.Struct('<4sHHIII')
+_LETTERS = 26
+_TAILS = _LETTERS * _LETTERS
+_A = ord('A')
+
+
+def _pad(size):
+    """Round size up to a multiple of 8"""
+    return (size + 7) & ~7
+
+
+def _tail_id(tail):
+    """Index of a two letter upper case tail, or None"""
+    if len(tail) != 2:
+        return None
+    first = ord(tail[0]) - _A
+    second = ord(tail[1]) - _A
+    if not (0 <= first < _LETTERS and 0 <= second < _LETTERS):
+        return None
+    return first * _LETTERS + second
+
+
+def is_stale(compiled_path, data_dir=DATA_DIR):
+    """True if any of the JSON files is newer than the compiled file"""
+    compiled_mtime = os.path.getmtime(compiled_path)
+    return any(os.path.getmtime(os.path.join(data_dir, name)) > compiled_mtime
+               for name in JSON_FILES)
+
+
+def compile_model(data_dir=DATA_DIR, compiled_path=None):
+    """Pack the JSON n-gram files in data_dir into the binary format
+    :param data_dir: directory holding the JSON files
+    :param compiled_path: output file; defaults to data_dir/ngrams.bin
+    :return: path of the compiled file
+    """
+    if compiled_path is None:
+        compiled_path = os.path.join(data_dir, COMPILED_FILE)
+    with open(os.path.join(data_dir, LENGTHS_FILE)) as lengths_file:
+        lengths = [int(weight) for weight in json.load(lengths_file)]
+    with open(os.path.join(data_dir, BIGRAMS_FILE)) as bigrams_file:
+        bigrams = json.load(bigrams_file)
+    with open(os.path.join(data_dir, TRIGRAMS_FILE)) as trigrams_file:
+        trigrams = json.load(trigrams_file)
+
+    length_cum = []
+    total = 0
+    for weight in lengths:
+        if weight < 0:
+            raise ValueError('Weights cannot be negative.')
+        total += weight
+        length_cum.append(total)
+
+    tail_index = [0] * (2 * _TAILS)
+    trans_letters = bytearray()
+    trans_cum = []
+    for tail in sorted(trigrams):
+        tail_id = _tail_id(tail)
+        if tail_id is None:
+            raise ValueError('Trigram tail must be two letters A-Z: {!r}'.format(tail))
+        offset = len(trans_cum)
+        total = 0
+        for letter, weight in trigrams[tail].items():
+            weight = int(weight)
+            if weight < 0:
+                raise ValueError('Weights cannot be negative.')
+            if weight == 0:
+                continue
+            total += weight
+            trans_letters.append(ord(letter))
+            trans_cum.append(total)
+        tail_index[2 * tail_id] = offset
+        tail_index[2 * tail_id + 1] = len(trans_cum) - offset
+
+    start_index = [0] * (2 * _LETTERS)
+    bigram_letters = bytearray()
+    bigram_cum = []
+    by_letter = {}
+    for bigram, weight in bigrams.items():
+        if _tail_id(bigram) is None:
+            raise ValueError('Start bigram must be two letters A-Z: {!r}'.format(bigram))
+        by_letter.setdefault(bigram[0], []).append((bigram, int(weight)))
+    for letter in sorted(by_letter):
+        offset = len(bigram_cum)
+        total = 0
+        for bigram, weight in by_letter[letter]:
+            if weight < 0:
+                raise ValueError('Weights cannot be negative.')
+            if weight == 0:
+                continue
+            total += weight
+            bigram_letters.extend(bigram.encode('ascii'))
+            bigram_cum.append(total)
+        start_index[2 * (ord(letter) - _A)] = offset
+        start_index[2 * (ord(letter) - _A) + 1] = len(bigram_cum) - offset
+
+    def padded(data):
+        return data + b'\0' * (_pad(len(data)) - len(data))
+
+    sections = [
+        padded(_HEADER.pack(MAGIC, VERSION, 0, len(length_cum), len(trans_cum), len(bigram_cum))),
+        struct.pack('<{}Q'.format(len(length_cum)), *length_cum),
+        struct.pack('<{}I'.format(len(tail_index)), *tail_index),
+        padded(bytes(trans_letters)),
+        struct.pack('<{}Q'.format(len(trans_cum)), *trans_cum),
+        padded(struct.pack('<{}I'.format(len(start_index)), *start_index)),
+        padded(bytes(bigram_letters)),
+        struct.pack('<{}Q'.format(len(bigram_cum)), *bigram_cum),
+    ]
+    # Write next to the target and rename, so a reader never sees half a file
+    temp_path = compiled_path + '.tmp'
+    with open(temp_path, 'wb') as compiled_file:
+        for section in sections:
+            compiled_file.write(section)
+    os.replace(temp_path, compiled_path)
+    return compiled_path
+
+
+class MappedModel(NgramModel):
+    """
+    N-gram model sampled directly from a memory-mapped compiled file
+    """
+
+    def __init__(self, buffer):
+        """
+        :param buffer: object supporting the buffer protocol, such as an mmap
+        """
+        super(MappedModel, self).__init__()
+        self._buffer = buffer
+        view = memoryview(buffer)
+        magic, version, _, n_lengths, n_transitions, n_bigrams = _HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('not a version {} compiled n-gram file'.format(VERSION))
+        if sys.byteorder != 'little':
+            # The arrays are read in native byte order
+            raise ValueError('compiled n-gram files need a little-endian host')
+        expected = (_pad(_HEADER.size) + 8 * n_lengths + 4 * 2 * _TAILS + _pad(n_transitions)
+                    + 8 * n_transitions + _pad(4 * 2 * _LETTERS) + _pad(2 * n_bigrams)
+                    + 8 * n_bigrams)
+        if len(view) < expected:
+            raise ValueError('compiled n-gram file is truncated')
+
+        def take(size, fmt=None):
+            nonlocal position
+            section = view[position:position + size]
+            position += _pad(size)
+            return section.cast(fmt) if fmt else section
+
+        position = _pad(_HEADER.size)
+        self._length_cum = take(8 * n_lengths, 'Q')
+        self._tail_index = take(4 * 2 * _TAILS, 'I')
+        self._trans_letters = take(n_transitions)
+        self._trans_cum = take(8 * n_transitions, 'Q')
+        self._start_index = take(4 * 2 * _LETTERS, 'I')
+        self._bigram_letters = take(2 * n_bigrams)
+        self._bigram_cum = take(8 * n_bigrams, 'Q')
+
+        self.length_samplers = {}
+        self.start_samplers = {}
+        self._bigrams = None
+        self._trigrams = None
+
+    @classmethod
+    def open(cls, compiled_path):
+        """Memory-map a compiled file read-only"""
+        with open(compiled_path, 'rb') as compiled_file:
+            buffer = mmap.mmap(compiled_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer)
+
+    def _tail_slice(self, tail):
+        """(offset, count) of a tail's transitions; count is 0 if it has none"""
+        tail_id = _tail_id(tail)
+        if tail_id is None:
+            return 0, 0
+        return self._tail_index[2 * tail_id], self._tail_index[2 * tail_id + 1]
+
+    def _start_slice(self, letter):
+        """(offset, count) of a letter's start bigrams"""
+        index = ord(letter) - _A if len(letter) == 1 else -1
+        if not 0 <= index < _LETTERS:
+            return 0, 0
+        return self._start_index[2 * index], self._start_index[2 * index + 1]
+
+    def _bigram(self, index):
+        return self._bigram_letters[2 * index:2 * index + 2].tobytes().decode('ascii')
+
+    def next_letter(self, tail, rng=random):
+        """Weighted random letter to follow a two letter tail
+        :param tail: upper case string
+        :param rng: random.Random instance, or the random module
+        :return: character, or None if the tail has no trigrams
+        """
+        offset, count = self._tail_slice(tail)
+        if not count:
+            return None
+        end = offset + count
+        rand = rng.randrange(self._trans_cum[end - 1])
+        return chr(self._trans_letters[bisect.bisect_right(self._trans_cum, rand, offset, end)])
+
+    def length_sampler(self, limit=None):
+        """WeightedSampler of word lengths shorter than limit, over the buffer
+        :param limit: int, exclusive upper bound; None for no limit
+        """
+        try:
+            return self.length_samplers[limit]
+        except KeyError:
+            cumulative = self._length_cum[:limit]
+            sampler = WeightedSampler.from_cumulative(range(len(cumulative)), cumulative)
+            self.length_samplers[limit] = sampler
+            return sampler
+
+    def start_sampler(self, letter):
+        """WeightedSampler of start bigrams beginning with letter, over the buffer
+        :param letter: upper case character
+        """
+        try:
+            return self.start_samplers[letter]
+        except KeyError:
+            offset, count = self._start_slice(letter)
+            keys = [self._bigram(index) for index in range(offset, offset + count)]
+            sampler = WeightedSampler.from_cumulative(
+                keys, self._bigram_cum[offset:offset + count])
+            self.start_samplers[letter] = sampler
+            return sampler
+
+    def owns(self, table):
+        """Whether table is this model's bigrams or trigrams dictionary,
+        checked without decoding either"""
+        return table is not None and (table is self._bigrams or table is self._trigrams)
+
+    def tails(self):
+        """All two letter tails that have trigrams"""
+        return [chr(_A + tail_id // _LETTERS) + chr(_A + tail_id % _LETTERS)
+                for tail_id in range(_TAILS) if self._tail_index[2 * tail_id + 1]]
+
+    def letter_weights(self, tail):
+        """Dictionary of letter -> weight that may follow tail"""
+        offset, count = self._tail_slice(tail)
+        weights = {}
+        previous = 0
+        for index in range(offset, offset + count):
+            weights[chr(self._trans_letters[index])] = self._trans_cum[index] - previous
+            previous = self._trans_cum[index]
+        return weights
+
+    def start_weights(self, letter):
+        """Dictionary of start bigram -> weight for bigrams beginning with letter"""
+        offset, count = self._start_slice(letter)
+        weights = {}
+        previous = 0
+        for index in range(offset, offset + count):
+            weights[self._bigram(index)] = self._bigram_cum[index] - previous
+            previous = self._bigram_cum[index]
+        return weights
+
+    @property
+    def lengths(self):
+        """Word length weights, as a list"""
+        cumulative = self._length_cum
+        return [cumulative[i] - (cumulative[i - 1] if i else 0) for i in range(len(cumulative))]
+
+    @property
+    def bigrams(self):
+        """Start bigram weights as a dictionary, decoded on first use"""
+        if self._bigrams is None:
+            self._bigrams = {}
+            for index in range(_LETTERS):
+                self._bigrams.update(self.start_weights(chr(_A + index)))
+        return self._bigrams
+
+    @property
+    def trigrams(self):
+        """Trigram weights as a dictionary, decoded on first use"""
+        if self._trigrams is None:
+            self._trigrams = {tail: self.letter_weights(tail) for tail in self.tails()}
+        return self._trigrams
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python3 -m freshdrip.compiled',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Compile the freshdrip JSON n-gram data to a memory-mappable file.')
+    parser.add_argument('-d', '--data-dir', default=DATA_DIR,
+                        help='Directory holding the JSON files')
+    parser.add_argument('-o', '--output', default=None,
+                        help='Compiled file to write; defaults to DATA_DIR/' + COMPILED_FILE)
+    args = parser.parse_args(argv)
+    print(compile_model(args.data_dir, args.output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -15,124 +15,155 @@ Start development: 2016-08-24
 Added class:       2017-06-21
 """
 
-import json
 import logging
-import os
 import random
-import sys
 
-logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+from freshdrip.model import DripModel, NoWordError, load_model
+from freshdrip.sampler import WeightedSampler
+
+logger = logging.getLogger(__name__)
+
 
 class DripWords(object):
     """
     DripWords includes methods to create the random english-like words 
     """
 
-    def fill_word(self, word, length, trigrams):
+    # Longest word length (exclusive) drawn for a phrase
+    MAX_WORD_LENGTH = 7
+    # Word lengths tried for a word with a set end character
+    MAX_ATTEMPTS = 10
+    # Pass as a bigrams or trigrams argument to use the model's own table
+    MODEL = object()
+
+    def __init__(self, model=None, rng=None):
+        """
+        :param model: DripModel or MappedModel; defaults to the shared,
+                      load-once model
+        :param rng: random.Random instance; defaults to the random module
+        """
+        self.model = model if model is not None else load_model()
+        self.rng = rng if rng is not None else random
+        # (bigrams, trigrams, DripModel) last built by model_for()
+        self._foreign_model = None
+
+    def _is_model_table(self, table):
+        """Whether table stands for the model's own; the model is asked
+        without reading its tables, which a MappedModel would decode"""
+        return table is self.MODEL or self.model.owns(table)
+
+    def fill_word(self, word, length, trigrams=MODEL):
         """Fill in the end of the word, using trigrams
         """
+        if self._is_model_table(trigrams):
+            # Use the model's precomputed samplers
+            return self.extend_word(word, length)
+
         while len(word) < length:
             _tail = word[-2:]
-            logging.debug('_tail: ' + str(_tail))
+            logger.debug('_tail: %s', _tail)
             if _tail in trigrams.keys():
                 word = word + self.dict_weighted_rand(trigrams[_tail])
             else:
                 return word
         return word
 
-    def return_trigram_letter(self, word, trigrams):
-        """return a single letter addable to the word, using trigrams
+    def extend_word(self, word, length, model=None):
+        """Fill in the end of the word, using the model's trigrams
+        """
+        model = self.model if model is None else model
+        while len(word) < length:
+            _letter = model.next_letter(word[-2:], self.rng)
+            if _letter is None:
+                return word
+            word = word + _letter
+        return word
+
+    def word(self, start, length, end=None, model=None):
+        """Create a word from the model, starting with a set character,
+        and optionally ending with one.
+        NOTE: A word with a set end character is at least three letters,
+        the start bigram plus the end character.
+        :param start: character
+        :param length: int
+        :param end: character, or None
+        :param model: model to draw from; defaults to self.model
+        :return _word: string
+        :raises NoWordError: if no such word can be made
         """
-        _tail = word[-2:]
-        logging.debug('_tail: ' + str(_tail))
-        if _tail in trigrams.keys():
-            return self.dict_weighted_rand(trigrams[_tail])
-        else:
-            return False
-
-    @staticmethod
-    def confirm_trigram_letter(word, trigrams, letter):
-        """add a single letter to the word, using trigrams
-        IF it matches the letter specified
+        model = self.model if model is None else model
+        if end is None:
+            _word = model.start_bigram(start.upper(), self.rng)
+            return self.extend_word(_word, length, model)
+
+        end = end.upper()
+        _steps = max(length, 3) - 2
+        _word = model.start_bigram_to(start.upper(), end, _steps, self.rng)
+        return self.walk_to_end(model, _word, end, _steps)
+
+    def word_to(self, start, end, length):
+        """word() with a set end character, drawing a new length whenever
+        no word of the current one can be made.
+        :raises NoWordError: if no word can be made in MAX_ATTEMPTS lengths
         """
-        _tail = word[-2:]
-        logging.debug('_tail: ' + str(_tail))
-        if _tail in trigrams.keys() and letter in trigrams[_tail].keys():
-            return True
-        else:
-            return False
+        for _ in range(self.MAX_ATTEMPTS):
+            try:
+                return self.word(start, length, end)
+            except NoWordError:
+                length = self.model.word_length(self.MAX_WORD_LENGTH, self.rng)
+        raise NoWordError('No word from {} to {} in {} lengths.'.format(
+            start, end, self.MAX_ATTEMPTS))
 
     def single_syllable_word(self, bigrams, start, length, trigrams, end='0'):
-        """Create a word, using bigrams and trigrams.
+        """Create a word, using bigrams and trigrams; see word().
         Make the end of the word match a set character.
-        NOTE: Assumes that the
         :param bigrams: dictionary
         :param start: character
         :param length: int
         :param trigrams: dictionary
-        :param end: character
+        :param end: character, or '0' for any
         :return _word: string
+        :raises NoWordError: if no such word can be made
         """
-
-        _used = ""
-        _letter = ""
-        _word = self.start_with_letter(bigrams, start)
-
-        if end == '0':
-            _word = self.fill_word(_word, length, trigrams)
-        else:
-            end = end.upper()
-            _word = self.fill_word(_word, length - 1, trigrams)
-
-            while len(_word) < length:
-                if self.confirm_trigram_letter(_word, trigrams, end):
-                    # the desired end character is available
-                    _word = _word + end
-                else:
-                    # the desired end character is not available, so
-                    # step back one letter and try a different branch
-                    _used = _used + _word[-1:]
-                    _word = _word[:-2]
-                    while True:
-                        _letter = self.return_trigram_letter(_word, trigrams)
-                        if isinstance(_letter, bool):
-                            # this should check if the _letter is a bool, but
-                            # FIXME: Why the hell is this ever a bool?
-                            break
-                        elif _letter not in _used:
-                            # FIXME: This could result in an infinite loop
-                            # FIXME: Also, there seems to be a bool in this comparison sometimes?
-                            # Traceback (most recent call last):
-                            #   File "freshdrip.py", line 211, in <module>
-                            #     print(drip.fresh_drip())
-                            #   File "freshdrip.py", line 195, in fresh_drip
-                            #     drip = self.single_syllable_word(bigrams, 'd', length, trigrams, 'p')
-                            #   File "freshdrip.py", line 105, in single_syllable_word
-                            #     if _letter not in _used:
-                            # TypeError: 'in <string>' requires string as left operand, not bool
-                            break
-                    _word = _word + _letter
+        return self.word(start, length, None if end == '0' else end,
+                         self.model_for(bigrams, trigrams))
+
+    def walk_to_end(self, model, word, end, steps):
+        """Add exactly steps letters to word, the last one being end.
+        Each letter is drawn only from those that can still reach the end
+        character in the remaining steps, so this never backtracks.
+        :param model: DripModel
+        :param word: string, at least two letters
+        :param end: upper case character
+        :param steps: int
+        :return _word: string
+        :raises NoWordError: if the word cannot reach the end character
+        """
+        _word = word
+        for _remaining in range(steps, 0, -1):
+            _word = _word + model.next_letter_to(_word[-2:], end, _remaining, self.rng)
         return _word
 
-    @staticmethod
-    def dict_weighted_rand(dictionary):
-        """Weighted random selection for dictionaries
+    def model_for(self, bigrams, trigrams):
+        """Return self.model if these are its tables, or a model built from
+        them, kept for the next call with the same tables"""
+        if self._is_model_table(bigrams) and self._is_model_table(trigrams):
+            return self.model
+        cached = self._foreign_model
+        if cached is None or cached[0] is not bigrams or cached[1] is not trigrams:
+            model = DripModel(self.model.lengths,
+                              self.model.bigrams if bigrams is self.MODEL else bigrams,
+                              self.model.trigrams if trigrams is self.MODEL else trigrams)
+            cached = (bigrams, trigrams, model)
+            self._foreign_model = cached
+        return cached[2]
+
+    def dict_weighted_rand(self, dictionary):
+        """Weighted random selection for dictionaries.
+        Builds a sampler for each call; only the model-backed paths use
+        precomputed ones.
         """
-        total_weight = 0
-        for key, weight_str in dictionary.items():
-            weight = int(weight_str)
-            if weight < 0:
-                raise ValueError('Weights cannot be negative.')
-            total_weight += weight
-        if total_weight == 0:
-            raise ValueError('Total weight must exceed zero.')
-
-        rand = random.randrange(1, total_weight + 1)
-        for key, weight_str in dictionary.items():
-            weight = int(weight_str)
-            rand -= weight
-            if rand <= 0:
-                return key
+        return WeightedSampler(dictionary).choice(self.rng)
 
     def start_with_letter(self, _bigrams, _letter):
         """Weighted random selection of start bigram,
@@ -140,63 +171,73 @@ class DripWords(object):
         """
         _letter_bigrams = {}
         _letter = _letter.upper()
-        logging.debug(_letter)
+        if self._is_model_table(_bigrams):
+            # Use the model's precomputed per-letter samplers
+            return self.model.start_bigram(_letter, self.rng)
+        logger.debug('letter: %s', _letter)
         for _bigram, _weight in _bigrams.items():
             if _letter == _bigram[0]:
                 _letter_bigrams[_bigram] = _weight
-        logging.debug(_letter_bigrams)
+        logger.debug('letter bigrams: %s', _letter_bigrams)
         return self.dict_weighted_rand(_letter_bigrams)
 
-    @staticmethod
-    def list_weighted_rand(_list):
-        """Weighted random selection for dictionaries:
+    def list_weighted_rand(self, _list):
+        """Weighted random selection for lists, returns the index.
+        Builds a sampler for each call; only the model-backed paths use
+        precomputed ones.
         """
-        total_weight = 0
-        for weight in _list:
-            if weight < 0:
-                raise ValueError('Weights cannot be negative.')
-            total_weight = total_weight + weight
-        if total_weight == 0:
-            raise ValueError('Total weight must exceed zero.')
-
-        rand = random.randrange(1, total_weight + 1)
-        list_index = 0
-        for weight in _list:
-            rand = rand - weight
-            if rand <= 0:
-                return list_index
-            list_index += 1
+        return WeightedSampler(_list).choice(self.rng)
 
     def fresh_drip(self):
         """
         Let's make some words!
         
         Make two words, one starting with "f",
-        the other starting with "d" and ending with "p"
+        the other starting with "d" and ending with "p".
+        A length no "d…p" word can be made in is drawn again.
+        :raises NoWordError: only if the model can hardly make "d…p" words
         """
-        freshdrip_dir = os.path.dirname(__file__)
-        with open(os.path.join(freshdrip_dir, 'data/distinct_word_lengths.json')) as lengths_file:
-            lengths = json.load(lengths_file)
-        with open(os.path.join(freshdrip_dir, 'data/word_start_bigrams.json')) as bigrams_file:
-            bigrams = json.load(bigrams_file)
-        with open(os.path.join(freshdrip_dir, 'data/trigrams.json')) as trigrams_file:
-            trigrams = json.load(trigrams_file)
-
         # Can limit here with an end slice, but this won't work for a start slice
-        length = self.list_weighted_rand(lengths[:7])
-        fresh = self.single_syllable_word(bigrams, 'f', length, trigrams)
+        length = self.model.word_length(self.MAX_WORD_LENGTH, self.rng)
+        fresh = self.word('f', length)
 
-        length = self.list_weighted_rand(lengths[:7])
-        drip = self.single_syllable_word(bigrams, 'd', length, trigrams, 'p')
+        length = self.model.word_length(self.MAX_WORD_LENGTH, self.rng)
+        drip = self.word_to('d', 'p', length)
 
         # Convert word to lower case and combine
         fresh_drip_phrase = fresh.title() + " " + drip.lower() + "."
 
-        logging.debug("Fresh Drip Bot says, “" + fresh_drip_phrase + "”")
+        logger.debug('Fresh Drip Bot says, “%s”', fresh_drip_phrase)
         return fresh_drip_phrase
 
+    def fresh_drip_many(self, n, seed=None):
+        """
+        Make n "fresh drip" phrases at once.
+
+        Word lengths and "f" start bigrams for the whole batch are drawn in
+        bulk up front; only the trigram letters are drawn per word.
+        :param n: int, number of phrases
+        :param seed: optional seed, for a reproducible batch
+        :return: list of strings
+        """
+        if seed is not None:
+            return DripWords(self.model, random.Random(seed)).fresh_drip_many(n)
+
+        rng = self.rng
+        lengths = self.model.length_sampler(self.MAX_WORD_LENGTH).sample(2 * n, rng)
+        fresh_starts = self.model.start_sampler('F').sample(n, rng)
+
+        phrases = []
+        for i in range(n):
+            fresh = self.extend_word(fresh_starts[i], lengths[2 * i])
+            # The "d…p" start bigram depends on its length, so it is drawn per word
+            drip = self.word_to('d', 'p', lengths[2 * i + 1])
+            phrases.append(fresh.title() + " " + drip.lower() + ".")
+        return phrases
+
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     for i in range(0, 10):
         drip = DripWords()
         print(drip.fresh_drip())
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+
+"""Load-once n-gram model for the "fresh drip" word generator
+
+The word length, start bigram and trigram tables are read from the
+JSON files in ``data/`` a single time, with their string weights
+converted to integers, and then shared by every DripWords instance
+for the life of the process. Weighted samplers for each trigram tail,
+each start letter and the word lengths are built alongside, so drawing
+a letter never has to walk a distribution again.
+
+Words that must end in a given letter use a reverse index: for each
+number of remaining steps, the set of tails from which the end letter
+can still be reached. Walking only through those tails produces a
+word of the requested length in exactly that many draws, with no
+backtracking.
+
+If a compiled ``data/ngrams.bin`` (see freshdrip.compiled) is present
+and not older than the JSON files, load_model memory-maps it instead.
+"""
+
+import json
+import logging
+import os
+import random
+import threading
+
+from freshdrip.sampler import WeightedSampler
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+LENGTHS_FILE = 'distinct_word_lengths.json'
+BIGRAMS_FILE = 'word_start_bigrams.json'
+TRIGRAMS_FILE = 'trigrams.json'
+JSON_FILES = (LENGTHS_FILE, BIGRAMS_FILE, TRIGRAMS_FILE)
+
+
+class NoWordError(ValueError):
+    """No word can be made that meets the requested constraints"""
+    pass
+
+
+class NgramModel(object):
+    """
+    Sampling interface shared by the JSON and the compiled models.
+
+    Subclasses provide length_sampler, start_sampler and next_letter,
+    plus tails, letter_weights and start_weights, which the end-letter
+    index is built from, and owns, which tells their own tables apart
+    from others.
+    """
+
+    def __init__(self):
+        # Reverse index and samplers for end-letter constrained words,
+        # built on first use
+        self.end_levels = {}
+        self.end_samplers = {}
+        self._end_lock = threading.Lock()
+
+    def end_index(self, end, steps):
+        """Tails from which end can be reached in exactly steps more letters
+        :param end: upper case character
+        :param steps: int, at least 1
+        :return: set of two letter tails
+        """
+        levels = self.end_levels.get(end)
+        if levels is not None and len(levels) > steps:
+            return levels[steps]
+        with self._end_lock:
+            levels = self.end_levels.setdefault(end, [frozenset()])
+            while len(levels) <= steps:
+                if len(levels) == 1:
+                    reach = frozenset(tail for tail in self.tails()
+                                      if self.letter_weights(tail).get(end, 0) > 0)
+                else:
+                    previous = levels[-1]
+                    reach = frozenset(tail for tail in self.tails()
+                                      if any(weight > 0 and tail[1] + letter in previous
+                                             for letter, weight
+                                             in self.letter_weights(tail).items()))
+                levels.append(reach)
+            return levels[steps]
+
+    def _end_sampler(self, key, weights):
+        """Cache a WeightedSampler for a constrained draw, or None if empty"""
+        try:
+            sampler = WeightedSampler(weights)
+        except ValueError:
+            sampler = None
+        self.end_samplers[key] = sampler
+        return sampler
+
+    def start_bigram_to(self, letter, end, steps, rng=random):
+        """Weighted random start bigram that can reach end in steps letters
+        :param letter: upper case character
+        :param end: upper case character
+        :param steps: int, letters still to add after the bigram
+        :param rng: random.Random instance, or the random module
+        :return: string
+        """
+        key = ('start', letter, end, steps)
+        try:
+            sampler = self.end_samplers[key]
+        except KeyError:
+            reach = self.end_index(end, steps)
+            sampler = self._end_sampler(key, {
+                bigram: weight for bigram, weight in self.start_weights(letter).items()
+                if bigram in reach})
+        if sampler is None:
+            raise NoWordError('No {}-letter word starts with {} and ends with {}.'.format(
+                steps + 2, letter, end))
+        return sampler.choice(rng)
+
+    def next_letter_to(self, tail, end, steps, rng=random):
+        """Weighted random letter after tail that can still reach end
+        :param tail: upper case string
+        :param end: upper case character
+        :param steps: int, letters still to add, including this one
+        :param rng: random.Random instance, or the random module
+        :return: character
+        """
+        key = (tail, end, steps)
+        try:
+            sampler = self.end_samplers[key]
+        except KeyError:
+            letters = self.letter_weights(tail)
+            if steps == 1:
+                weights = {end: letters.get(end, 0)}
+            else:
+                reach = self.end_index(end, steps - 1)
+                weights = {letter: weight for letter, weight in letters.items()
+                           if tail[1] + letter in reach}
+            sampler = self._end_sampler(key, weights)
+        if sampler is None:
+            raise NoWordError('Cannot reach {} from {} in {} letters.'.format(
+                end, tail, steps))
+        return sampler.choice(rng)
+
+    def word_length(self, limit=None, rng=random):
+        """Weighted random word length, shorter than limit
+        :param limit: int, exclusive upper bound; None for no limit
+        :param rng: random.Random instance, or the random module
+        :return: int
+        """
+        return self.length_sampler(limit).choice(rng)
+
+    def start_bigram(self, letter, rng=random):
+        """Weighted random start bigram beginning with letter
+        :param letter: upper case character
+        :param rng: random.Random instance, or the random module
+        :return: string
+        """
+        return self.start_sampler(letter).choice(rng)
+
+
+class DripModel(NgramModel):
+    """
+    Word length, start bigram and trigram weights, as integers
+    """
+
+    def __init__(self, lengths, bigrams, trigrams):
+        """
+        :param lengths: list of weights, indexed by word length
+        :param bigrams: dictionary of start bigram -> weight
+        :param trigrams: dictionary of two letter tail -> {letter: weight}
+        """
+        super(DripModel, self).__init__()
+        self.lengths = [int(weight) for weight in lengths]
+        self.bigrams = {bigram: int(weight) for bigram, weight in bigrams.items()}
+        self.trigrams = {tail: {letter: int(weight) for letter, weight in letters.items()}
+                         for tail, letters in trigrams.items()}
+
+        self.trigram_samplers = {tail: WeightedSampler(letters)
+                                 for tail, letters in self.trigrams.items()}
+        self.start_bigrams = {}
+        for bigram, weight in self.bigrams.items():
+            self.start_bigrams.setdefault(bigram[0], {})[bigram] = weight
+        self.start_samplers = {letter: WeightedSampler(letter_bigrams)
+                               for letter, letter_bigrams in self.start_bigrams.items()
+                               if sum(letter_bigrams.values()) > 0}
+        self.length_samplers = {}
+
+    def owns(self, table):
+        """Whether table is this model's bigrams or trigrams dictionary"""
+        return table is self.bigrams or table is self.trigrams
+
+    def tails(self):
+        """All two letter tails that have trigrams"""
+        return self.trigrams.keys()
+
+    def letter_weights(self, tail):
+        """Dictionary of letter -> weight that may follow tail"""
+        return self.trigrams.get(tail, {})
+
+    def start_weights(self, letter):
+        """Dictionary of start bigram -> weight for bigrams beginning with letter"""
+        return self.start_bigrams.get(letter, {})
+
+    def length_sampler(self, limit=None):
+        """WeightedSampler of word lengths shorter than limit
+        :param limit: int, exclusive upper bound; None for no limit
+        """
+        try:
+            return self.length_samplers[limit]
+        except KeyError:
+            sampler = WeightedSampler(self.lengths[:limit])
+            self.length_samplers[limit] = sampler
+            return sampler
+
+    def start_sampler(self, letter):
+        """WeightedSampler of start bigrams beginning with letter
+        :param letter: upper case character
+        """
+        try:
+            return self.start_samplers[letter]
+        except KeyError:
+            raise ValueError('Total weight must exceed zero.')
+
+    def next_letter(self, tail, rng=random):
+        """Weighted random letter to follow a two letter tail
+        :param tail: upper case string
+        :param rng: random.Random instance, or the random module
+        :return: character, or None if the tail has no trigrams
+        """
+        sampler = self.trigram_samplers.get(tail)
+        if sampler is None:
+            return None
+        return sampler.choice(rng)
+
+    @classmethod
+    def from_json(cls, data_dir=DATA_DIR):
+        """Read the model from the JSON files in data_dir"""
+        with open(os.path.join(data_dir, LENGTHS_FILE)) as lengths_file:
+            lengths = json.load(lengths_file)
+        with open(os.path.join(data_dir, BIGRAMS_FILE)) as bigrams_file:
+            bigrams = json.load(bigrams_file)
+        with open(os.path.join(data_dir, TRIGRAMS_FILE)) as trigrams_file:
+            trigrams = json.load(trigrams_file)
+        return cls(lengths, bigrams, trigrams)
+
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def load_model():
+    """Return the shared model, loading it on first use.
+    Uses the compiled binary when it is up to date, else the JSON files.
+    """
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = open_model()
+    return _model
+
+
+def open_model(data_dir=DATA_DIR):
+    """Memory-map the compiled model in data_dir if it is current,
+    else read the JSON files
+    """
+    from freshdrip.compiled import COMPILED_FILE, MappedModel, is_stale
+
+    compiled_path = os.path.join(data_dir, COMPILED_FILE)
+    if os.path.exists(compiled_path):
+        if is_stale(compiled_path, data_dir):
+            logger.warning('%s is older than the JSON data; using the JSON. '
+                           'Rebuild with: python3 -m freshdrip.compiled', compiled_path)
+        else:
+            try:
+                return MappedModel.open(compiled_path)
+            except (OSError, ValueError) as err:
+                logger.warning('Could not load %s (%s); using the JSON.', compiled_path, err)
+    return DripModel.from_json(data_dir)
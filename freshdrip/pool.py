@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+"""Prefetched pool of "fresh drip" phrases
+
+A PhrasePool keeps a few phrases ready, refilled by a background thread
+whenever the pool drops to its refill threshold, so asking for a phrase
+is just a pop. Each phrase is remembered in a bounded history when it
+is made, for the pool or on demand, not when it is handed out; a new
+phrase that matches one in the history is drawn again.
+"""
+
+import collections
+import logging
+import threading
+import time
+
+from freshdrip.freshdrip import DripWords
+
+logger = logging.getLogger(__name__)
+
+
+class PhrasePool(object):
+    """
+    Background-filled pool of ready phrases
+    """
+
+    # How many times to redraw a phrase that was made recently
+    MAX_ATTEMPTS = 10
+
+    def __init__(self, words=None, depth=8, refill_at=4, history=64, timer=None):
+        """
+        :param words: DripWords; defaults to one using the shared model
+        :param depth: int, phrases to keep ready
+        :param refill_at: int, refill when this many or fewer are ready
+        :param history: int, recent phrases not to repeat
+        :param timer: callable(seconds), told how long each phrase took to
+                      generate, in the background or on a miss
+        """
+        if not 0 <= refill_at < depth:
+            raise ValueError('refill_at must be at least 0 and less than depth.')
+        self.words = words if words is not None else DripWords()
+        self.depth = depth
+        self.refill_at = refill_at
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self._phrases = collections.deque()
+        self._recent = collections.deque(maxlen=history)
+        self._recent_set = set()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def start(self):
+        """Start the refill thread; the pool fills up in the background"""
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._refill, name='PhrasePool', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the refill thread"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def __len__(self):
+        return len(self._phrases)
+
+    def get(self):
+        """Return a ready phrase, or make one now if the pool is empty"""
+        with self._condition:
+            if self._phrases:
+                self.hits += 1
+                phrase = self._phrases.popleft()
+                if len(self._phrases) <= self.refill_at:
+                    self._condition.notify()
+                return phrase
+            self.misses += 1
+            self._condition.notify()
+        return self._make_phrase()
+
+    # Drop-in for DripWords.fresh_drip
+    fresh_drip = get
+
+    def stats(self):
+        """Pool counters, as a dictionary"""
+        with self._condition:
+            return {'hits': self.hits, 'misses': self.misses, 'ready': len(self._phrases)}
+
+    def _make_phrase(self):
+        """Make a phrase that is not in the recent history, and remember it"""
+        for _ in range(self.MAX_ATTEMPTS):
+            started = time.perf_counter()
+            phrase = self.words.fresh_drip()
+            if self.timer is not None:
+                self.timer(time.perf_counter() - started)
+            if phrase not in self._recent_set:
+                break
+        with self._condition:
+            # A phrase still in the history after every attempt is not added
+            # again: evicting the older copy would drop it from the set early
+            if self._recent.maxlen and phrase not in self._recent_set:
+                if len(self._recent) == self._recent.maxlen:
+                    self._recent_set.discard(self._recent[0])
+                self._recent.append(phrase)
+                self._recent_set.add(phrase)
+        return phrase
+
+    def _refill(self):
+        """Refill thread: top the pool up to depth whenever it runs low"""
+        while True:
+            with self._condition:
+                while not self._stopped and len(self._phrases) > self.refill_at:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                wanted = self.depth - len(self._phrases)
+            try:
+                phrases = [self._make_phrase() for _ in range(wanted)]
+            except Exception:
+                logger.exception('PhrasePool refill failed')
+                with self._condition:
+                    self._condition.wait(1.0)
+                continue
+            with self._condition:
+                self._phrases.extend(phrases)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+"""Precomputed weighted random selection
+
+A WeightedSampler walks its weights once, when it is built, and keeps
+the running totals. Each draw after that is a single random integer
+and a binary search over the totals, instead of two passes over the
+whole distribution.
+"""
+
+import bisect
+import random
+
+
+class WeightedSampler(object):
+    """
+    Weighted random choice over a fixed set of keys
+    """
+
+    __slots__ = ('keys', 'cumulative', 'total')
+
+    def __init__(self, weights):
+        """
+        :param weights: dictionary of key -> weight, or a list of
+                        weights, in which case the keys are the indices
+        """
+        if isinstance(weights, dict):
+            items = weights.items()
+        else:
+            items = enumerate(weights)
+
+        self.keys = []
+        self.cumulative = []
+        total = 0
+        for key, weight in items:
+            weight = int(weight)
+            if weight < 0:
+                raise ValueError('Weights cannot be negative.')
+            if weight == 0:
+                continue
+            total += weight
+            self.keys.append(key)
+            self.cumulative.append(total)
+        if total == 0:
+            raise ValueError('Total weight must exceed zero.')
+        self.total = total
+
+    @classmethod
+    def from_cumulative(cls, keys, cumulative):
+        """Build a sampler from keys and their running totals, as stored
+        :param keys: sequence of keys
+        :param cumulative: sequence of int running totals, one per key
+        """
+        if not len(cumulative) or cumulative[-1] <= 0:
+            raise ValueError('Total weight must exceed zero.')
+        sampler = cls.__new__(cls)
+        sampler.keys = keys
+        sampler.cumulative = cumulative
+        sampler.total = cumulative[-1]
+        return sampler
+
+    def __len__(self):
+        return len(self.keys)
+
+    def choice(self, rng=random):
+        """Return one key, chosen with probability proportional to its weight
+        :param rng: random.Random instance, or the random module
+        """
+        return self.keys[bisect.bisect_right(self.cumulative, rng.randrange(self.total))]
+
+    def sample(self, count, rng=random):
+        """Return a list of count keys, drawn with replacement in one call
+        :param count: int
+        :param rng: random.Random instance, or the random module
+        """
+        return rng.choices(self.keys, cum_weights=self.cumulative, k=count)
@@ -1,3 +1,5 @@
-from matterhook.incoming import Webhook
+from matterhook.fanout import DeliveryResult, FanOut
+from matterhook.incoming import MessageTemplate, Webhook
+from matterhook.spool import Spool
 
-__all__ = ['Webhook']
+__all__ = ['Webhook', 'MessageTemplate', 'Spool', 'FanOut', 'DeliveryResult']
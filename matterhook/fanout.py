@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Send one message to several webhooks at once.
+
+Each target is a Webhook with its own url, channel, username and
+icon_url. The message text is JSON-escaped once and spliced into each
+target's pre-encoded template. Deliveries run concurrently on a bounded
+worker pool, so a fan-out takes about as long as its slowest target.
+"""
+
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from matterhook.incoming import encode_text
+
+__all__ = ['FanOut', 'DeliveryResult']
+
+DeliveryResult = collections.namedtuple('DeliveryResult', ['target', 'ok', 'error', 'seconds'])
+DeliveryResult.__doc__ = """Outcome of sending to one target: ok, the exception if not, and the time taken"""
+
+
+class FanOut(object):
+    """
+    Concurrent delivery of the same message to a list of Webhook targets.
+    """
+
+    def __init__(self, targets, max_workers=4):
+        """
+        :param targets: iterable of Webhook; the caller owns them, and
+                        closes them when done
+        :param max_workers: int, most deliveries in flight at once
+        """
+        self.targets = list(targets)
+        self.max_workers = max_workers
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def executor(self):
+        """Worker pool, created on first use"""
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def close(self):
+        """Shut down the worker pool; the targets are left open"""
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    @staticmethod
+    def _deliver(target, text):
+        started = time.perf_counter()
+        try:
+            target.post_body(target.template().splice(text))
+        except Exception as err:
+            return DeliveryResult(target, False, err, time.perf_counter() - started)
+        return DeliveryResult(target, True, None, time.perf_counter() - started)
+
+    def send_async(self, message):
+        """Start delivering message to every target
+        :return: list of futures of DeliveryResult, in target order
+        """
+        text = encode_text(message)
+        return [self.executor.submit(self._deliver, target, text) for target in self.targets]
+
+    def send(self, message):
+        """Deliver message to every target, and wait for all of them
+        :return: list of DeliveryResult, in target order
+        """
+        return [future.result() for future in self.send_async(message)]
@@ -4,14 +4,21 @@
 # Modified to ignore SSL verification, since I can't currently
 # get it to accept proper SSL connections from the Omni CA
 
+import json
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from json.encoder import encode_basestring_ascii
 import requests
 import urllib3
+from requests.adapters import HTTPAdapter
 
 # Silence the SubjectAltNameWarning that our self-signed CA gives
 urllib3.disable_warnings(urllib3.exceptions.SubjectAltNameWarning)
 
-__all__ = ['Webhook']
+__all__ = ['Webhook', 'MessageTemplate', 'encode_text']
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
 
 
 class InvalidPayload(Exception):
@@ -22,53 +29,179 @@ class HTTPError(Exception):
     pass
 
 
+class MessageTemplate(object):
+    """
+    Pre-encoded JSON body for messages with a fixed channel, icon_url
+    and username. The fixed part is encoded once; each body() only
+    escapes the text and splices it in.
+    """
+
+    __slots__ = ('channel', 'icon_url', 'username', 'prefix')
+
+    def __init__(self, channel=None, icon_url=None, username=None):
+        self.channel = channel
+        self.icon_url = icon_url
+        self.username = username
+        fields = [('channel', channel), ('icon_url', icon_url), ('username', username)]
+        static = json.dumps(dict((key, value) for key, value in fields if value),
+                            separators=(',', ':'))
+        # '{"channel":"x"}' -> '{"channel":"x","text":'
+        self.prefix = (static[:-1] + (',' if len(static) > 2 else '') + '"text":').encode('ascii')
+
+    def body(self, message):
+        """The JSON request body, as bytes, for one message"""
+        return self.splice(encode_text(message))
+
+    def splice(self, text):
+        """The JSON request body for text already escaped by encode_text()"""
+        return b''.join((self.prefix, text, b'}'))
+
+
+def encode_text(message):
+    """A message as an escaped JSON string, in bytes, ready for MessageTemplate.splice()"""
+    if not isinstance(message, str):
+        message = str(message)
+    return encode_basestring_ascii(message).encode('ascii')
+
+
 class Webhook(object):
     """
     Interacts with a Mattermost incoming webhook.
+
+    Each Webhook owns a requests.Session, so repeated sends reuse one
+    kept-alive connection instead of paying a new TCP and TLS handshake.
+    send_async() sends on a worker thread owned by the Webhook, in the
+    order messages were queued. Call close(), or use the Webhook as a
+    context manager, when done.
+
+    Request bodies come from a MessageTemplate per channel, icon_url
+    and username combination, made on first use and kept.
     """
 
+    # Most templates kept; past this the cache starts over
+    MAX_TEMPLATES = 64
+
     def __init__(self,
                  url,
                  api_key,
                  channel=None,
                  icon_url=None,
-                 username=None):
+                 username=None,
+                 pool_size=2,
+                 connect_timeout=3.05,
+                 read_timeout=10):
         self.api_key = api_key
         self.channel = channel
         self.icon_url = icon_url
         self.username = username
         self.url = url
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
         self.dir = os.path.dirname(__file__)
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._executor = None
+        self._templates = {}
         # a cert may be needed if you're on a secure office network
         # self.cert_file_path = os.path.join(self.dir, '../certificate_ca.pem')
 
     def __setitem__(self, channel, payload):
         if isinstance(payload, dict):
-            try:
-                message = payload.pop('text')
-            except KeyError:
+            if 'text' not in payload:
                 raise InvalidPayload('missing "text" key')
+            # Leave the caller's dict as it was
+            options = dict((key, value) for key, value in payload.items() if key != 'text')
+            options.setdefault('channel', channel)
+            self.send(payload['text'], **options)
         else:
-            message = payload
-            payload = {}
-        self.send(message, **payload)
+            self.send(payload, channel=channel)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def session(self):
+        """The Webhook's own requests.Session, created on first use"""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+        return self._session
+
+    @property
+    def executor(self):
+        """Single worker thread for send_async, created on first use"""
+        if self._executor is None:
+            with self._session_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=1)
+        return self._executor
+
+    def close(self):
+        """Finish queued sends, then close the session and its pooled connections"""
+        with self._session_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        with self._session_lock:
+            session, self._session = self._session, None
+        if session is not None:
+            session.close()
 
     @property
     def incoming_hook_url(self):
+        # With no API key, url is the full hook URL, as for Slack-compatible hooks
+        if self.api_key is None:
+            return self.url
         return '{}/hooks/{}'.format(self.url, self.api_key)
 
-    def send(self, message, channel=None, icon_url=None, username=None):
-        payload = {'text': message}
+    def template(self, channel=None, icon_url=None, username=None):
+        """The MessageTemplate for these settings, with the Webhook's defaults filled in"""
+        key = (channel or self.channel, icon_url or self.icon_url, username or self.username)
+        template = self._templates.get(key)
+        if template is None:
+            if len(self._templates) >= self.MAX_TEMPLATES:
+                self._templates = {}
+            template = MessageTemplate(*key)
+            self._templates[key] = template
+        return template
+
+    def body(self, message, channel=None, icon_url=None, username=None):
+        """The JSON request body for a message, as bytes"""
+        return self.template(channel, icon_url, username).body(message)
 
-        if channel or self.channel:
-            payload['channel'] = channel or self.channel
-        if icon_url or self.icon_url:
-            payload['icon_url'] = icon_url or self.icon_url
-        if username or self.username:
-            payload['username'] = username or self.username
+    def send(self, message, channel=None, icon_url=None, username=None):
+        self.post_body(self.template(channel, icon_url, username).body(message))
 
-        r = requests.post(self.incoming_hook_url, json=payload)
+    def post_body(self, body):
+        """Post an encoded JSON body to the incoming webhook"""
+        r = self.session.post(self.incoming_hook_url, data=body, headers=JSON_HEADERS,
+                              timeout=self.timeout)
         # Or with the cert:
-        # r = requests.post(self.incoming_hook_url, json=payload, verify=self.cert_file_path)
+        # r = self.session.post(self.incoming_hook_url, data=body, headers=JSON_HEADERS,
+        #                       timeout=self.timeout, verify=self.cert_file_path)
         if r.status_code != 200:
             raise HTTPError(r.text)
+
+    def send_async(self, message, channel=None, icon_url=None, username=None, callback=None):
+        """
+        Send without waiting for the server.
+
+        Returns a concurrent.futures.Future whose result() is None once
+        sent, or raises the send's exception. If given, callback(future)
+        is called when the send completes, on the worker thread; if the
+        send has already completed by the time the callback is added, it
+        is called at once, on the calling thread. Either way it must be
+        safe to run on any thread.
+        """
+        future = self.executor.submit(self.send, message, channel, icon_url, username)
+        if callback is not None:
+            future.add_done_callback(callback)
+        return future
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Durable outbound spool for a Webhook.
+
+Each message is written to a small SQLite database before it is sent,
+and only removed once the server has accepted it. A worker thread
+delivers the entries strictly in order; when a send fails, the head
+entry is retried with exponential backoff and jitter, and everything
+behind it waits. An entry that has failed max_attempts times, or has
+been failing for longer than max_age, is given up on and moved to a
+dead-letter table, so a message the server will never accept doesn't
+hold up the rest. Undelivered entries are picked up again after a
+restart.
+"""
+
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+__all__ = ['Spool']
+
+logger = logging.getLogger(__name__)
+
+
+class Spool(object):
+    """
+    On-disk, retrying, in-order outbox for a Webhook.
+    """
+
+    FILENAME = 'spool.sqlite3'
+
+    def __init__(self,
+                 webhook,
+                 directory,
+                 base_delay=1.0,
+                 max_delay=300.0,
+                 jitter=0.5,
+                 max_attempts=20,
+                 max_age=7200.0):
+        """
+        :param webhook: Webhook to deliver through
+        :param directory: directory for the spool database; created if needed
+        :param base_delay: seconds to wait after the first failure
+        :param max_delay: longest wait between attempts, in seconds
+        :param jitter: fraction of each wait to randomize, 0 to 1
+        :param max_attempts: failed attempts before an entry is given up on;
+                             None to retry without limit
+        :param max_age: seconds since it was spooled after which a failing
+                        entry is given up on; None for no limit
+        """
+        self.webhook = webhook
+        self.directory = directory
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.max_attempts = max_attempts
+        self.max_age = max_age
+        self.delivered = 0
+        self.failures = 0
+        self.last_latency = None
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, self.FILENAME)
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS outbox ('
+                         'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                         'payload TEXT NOT NULL, '
+                         'created REAL NOT NULL, '
+                         'attempts INTEGER NOT NULL DEFAULT 0)')
+        # Entries given up on, kept for inspection
+        self._db.execute('CREATE TABLE IF NOT EXISTS dead ('
+                         'id INTEGER PRIMARY KEY, '
+                         'payload TEXT NOT NULL, '
+                         'created REAL NOT NULL, '
+                         'attempts INTEGER NOT NULL, '
+                         'failed REAL NOT NULL, '
+                         'error TEXT)')
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def put(self, message, channel=None, icon_url=None, username=None):
+        """Store a message for delivery, and return its spool id"""
+        # Stored as the request body, encoded once, ready to post as it is
+        body = self.webhook.body(message, channel, icon_url, username).decode('ascii')
+        with self._condition:
+            cursor = self._db.execute('INSERT INTO outbox (payload, created) VALUES (?, ?)',
+                                      (body, time.time()))
+            self._condition.notify()
+            return cursor.lastrowid
+
+    def depth(self):
+        """Number of messages waiting to be delivered"""
+        with self._condition:
+            return self._db.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+
+    def dead(self):
+        """Number of messages given up on, kept in the dead-letter table"""
+        with self._condition:
+            return self._db.execute('SELECT COUNT(*) FROM dead').fetchone()[0]
+
+    def stats(self):
+        """Queue depth, dead letters and delivery latency, as a dictionary"""
+        depth = self.depth()
+        dead = self.dead()
+        with self._condition:
+            return {
+                'depth': depth,
+                'dead': dead,
+                'delivered': self.delivered,
+                'failures': self.failures,
+                'last_latency': self.last_latency,
+                'max_latency': self.max_latency,
+                'mean_latency': self.total_latency / self.delivered if self.delivered else None,
+            }
+
+    def start(self):
+        """Start delivering in the background, including entries left from a previous run"""
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._deliver, name='Spool', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop delivering; undelivered entries stay in the spool"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def close(self):
+        """Stop delivering and close the database"""
+        self.stop()
+        with self._condition:
+            self._db.close()
+
+    def backoff(self, attempts):
+        """Seconds to wait before the next attempt, after attempts failures"""
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempts - 1)))
+        return delay * (1 - self.jitter * random.random())
+
+    def exhausted(self, attempts, created):
+        """Whether an entry that has failed attempts times should be given up on"""
+        if self.max_attempts is not None and attempts >= self.max_attempts:
+            return True
+        return self.max_age is not None and time.time() - created >= self.max_age
+
+    def _deliver(self):
+        """Worker thread: deliver the oldest entry, retrying it until it goes
+        or is given up on"""
+        while True:
+            with self._condition:
+                while True:
+                    if self._stopped:
+                        return
+                    row = self._db.execute('SELECT id, payload, created, attempts FROM outbox '
+                                           'ORDER BY id LIMIT 1').fetchone()
+                    if row is not None:
+                        break
+                    self._condition.wait()
+            entry_id, payload, created, attempts = row
+
+            try:
+                self.webhook.post_body(payload.encode('utf-8'))
+            except Exception as err:
+                attempts += 1
+                if self.exhausted(attempts, created):
+                    logger.error('Spool entry %d failed %d times, giving up on it: %s',
+                                 entry_id, attempts, err)
+                    with self._condition:
+                        self.failures += 1
+                        self._db.execute('BEGIN')
+                        self._db.execute('INSERT INTO dead (id, payload, created, attempts, '
+                                         'failed, error) VALUES (?, ?, ?, ?, ?, ?)',
+                                         (entry_id, payload, created, attempts, time.time(),
+                                          str(err)))
+                        self._db.execute('DELETE FROM outbox WHERE id = ?', (entry_id,))
+                        self._db.execute('COMMIT')
+                    continue
+                delay = self.backoff(attempts)
+                logger.warning('Spool entry %d failed (attempt %d), retrying in %.1f s: %s',
+                               entry_id, attempts, delay, err)
+                with self._condition:
+                    self.failures += 1
+                    self._db.execute('UPDATE outbox SET attempts = ? WHERE id = ?',
+                                     (attempts, entry_id))
+                    # Wake early only to stop; new entries queue behind this one
+                    deadline = time.monotonic() + delay
+                    while not self._stopped and time.monotonic() < deadline:
+                        self._condition.wait(deadline - time.monotonic())
+                continue
+
+            latency = time.time() - created
+            with self._condition:
+                self._db.execute('DELETE FROM outbox WHERE id = ?', (entry_id,))
+                self.delivered += 1
+                self.last_latency = latency
+                self.max_latency = max(self.max_latency, latency)
+                self.total_latency += latency
+            logger.debug('Spool entry %d delivered after %.2f s', entry_id, latency)
@@ -0,0 +1,46 @@
+"""Button state machine, on simulated GPIO and a real Scheduler"""
+
+import threading
+import time
+import unittest
+
+from dripbot_button import Button
+from dripbot_hardware import SimulatedGPIO
+from dripbot_scheduler import Scheduler
+
+PIN = 24
+
+
+class ButtonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.gpio = SimulatedGPIO()
+        self.gpio.setmode(self.gpio.BCM)
+        self.scheduler = Scheduler()
+        self.scheduler.start()
+        self.tapped = threading.Event()
+        self.button = Button(self.gpio, PIN, self.scheduler, self.tapped.set, lambda: None)
+        self.button.start()
+
+    def tearDown(self):
+        self.button.stop()
+        self.scheduler.stop()
+
+    def test_tap(self):
+        self.gpio.bounce(PIN, hold=0.3)
+        self.assertTrue(self.tapped.wait(1.0))
+        self.assertEqual((self.button.taps, self.button.holds), (1, 0))
+
+    def test_tap_behind_busy_scheduler(self):
+        # Both edges of the tap are queued while the scheduler is blocked
+        self.scheduler.call_soon(time.sleep, 0.6)
+        time.sleep(0.05)
+        self.gpio.press(PIN, hold=0.3)
+        self.assertTrue(self.tapped.wait(2.0))
+        self.assertEqual(self.button.stats()['taps'], 1)
+        self.assertEqual(self.button.bounces, 0)
+        self.assertAlmostEqual(self.button.last_decided - self.button.last_press, 0.3, delta=0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()